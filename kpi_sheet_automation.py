@@ -10,11 +10,26 @@ from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 from dotenv import load_dotenv
 import os
-from cryptography.hazmat.primitives import serialization
+import logging
+import logging.handlers
+from types import MappingProxyType
+from snowflake_auth import load_private_key
 
 # ---- Load environment variables ----
 load_dotenv()
 
+# ---- Logging ----
+# Per-row lines are DEBUG (LOG_LEVEL=DEBUG to see them) and are buffered in memory
+# until the INFO summary (or exit) instead of being written one by one.
+_log_target = logging.StreamHandler()
+_log_target.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(
+    level=logging.INFO,
+    handlers=[logging.handlers.MemoryHandler(capacity=500, flushLevel=logging.INFO, target=_log_target)],
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
 SNOWFLAKE_USER = os.getenv("SNOWFLAKE_USER")
 SNOWFLAKE_ACCOUNT = os.getenv("SNOWFLAKE_ACCOUNT")
 SNOWFLAKE_WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE")
@@ -23,11 +38,6 @@ SNOWFLAKE_SCHEMA = os.getenv("SNOWFLAKE_SCHEMA")
 SF_PRIVATE_KEY_PATH = os.getenv("SNOWFLAKE_PRIVATE_KEY_PATH", os.path.join(os.path.dirname(__file__), "rsa_key.p8"))
 GOOGLE_CREDENTIALS_PATH = os.getenv("GOOGLE_CREDENTIALS_PATH")
 
-def load_private_key(path):
-    """Load private key for Snowflake authentication"""
-    with open(path, "rb") as key_file:
-        return serialization.load_pem_private_key(key_file.read(), password=None)
-
 # ---- SQL Query ----
 SQL_QUERY = """
     SELECT KPI_NAME, KPI_VALUE, MONTH
@@ -45,25 +55,48 @@ conn = snowflake.connector.connect(
     schema=SNOWFLAKE_SCHEMA
 )
 
+# Submit the query without waiting; the Google Sheets setup below runs while Snowflake executes it
 cursor = conn.cursor()
-cursor.execute(SQL_QUERY)
-columns = [col[0] for col in cursor.description]
-data = cursor.fetchall()
-df = pd.DataFrame(data, columns=columns)
+cursor.execute_async(SQL_QUERY)
+query_id = cursor.sfqid
+
+# ---- Connect to Google Sheets ----
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+if not GOOGLE_CREDENTIALS_PATH:
+    raise ValueError("GOOGLE_CREDENTIALS_PATH env var is required for Google Sheets access")
+creds = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_PATH, scopes=SCOPES)
+client = gspread.authorize(creds)
+
+spreadsheet = client.open("KPI NEW AUTOMATED")   #update
+sheet = spreadsheet.worksheet("KPI")    #update
+
+# Get sheet headers (row 1, months), KPI names (col A) and Types (col B) in one request
+value_ranges = spreadsheet.values_batch_get(
+    ranges=[f"'{sheet.title}'!1:1", f"'{sheet.title}'!A:A", f"'{sheet.title}'!B:B"]
+)["valueRanges"]
+header_rows, kpi_rows, type_rows = (vr.get("values", []) for vr in value_ranges)
+headers = header_rows[0] if header_rows else []
+sheet_kpis = [r[0] if r else "" for r in kpi_rows]
+sheet_types = [r[0] if r else "" for r in type_rows]
+
+# ---- Collect the Snowflake result ----
+conn.get_query_status_throw_if_error(query_id)
+cursor.get_results_from_sfqid(query_id)
+df = cursor.fetch_pandas_all()
 cursor.close()
 conn.close()
 
-# ---- Add total_customers as sum of prod + cons ----
-totals = (
-    df[df["KPI_NAME"].isin(["total_consumption_customers", "total_production_customers"])]
-    .groupby("MONTH")["KPI_VALUE"].sum()
-    .reset_index()
-)
-totals["KPI_NAME"] = "total_customers"
-df = pd.concat([df, totals], ignore_index=True)
+# Convert MONTH to datetime for proper comparison
+df["MONTH"] = pd.to_datetime(df["MONTH"])
+
+# Get the latest month (true max, not alphabetical)
+latest_month = df["MONTH"].max()
+
+# Filter to latest month only
+df = df[df["MONTH"] == latest_month].reset_index(drop=True)
 
 # ---- KPI Mapping ----
-KPI_MAPPING = {
+KPI_MAPPING = MappingProxyType({
     #customers
     "total_consumption_customers": "Customers in Delivery (SE Consumption)",
     "total_production_customers": "Customers in Delivery (SE Production)",
@@ -154,39 +187,22 @@ KPI_MAPPING = {
     "customer_satisfaction_ai_teammate": "Customer satisfaction - AI teammate",
     "customer_satisfaction_physical_teammate": "Customer satisfaction - Physical teammate"
 
-}
+})
 
-# Map KPI_NAME to display name
-df["KPI_DISPLAY"] = df["KPI_NAME"].map(KPI_MAPPING)
+# Month string for matching sheet headers
+latest_month_str = latest_month.strftime("%B %Y")
 
-# Convert MONTH to datetime for proper comparison
-df["MONTH"] = pd.to_datetime(df["MONTH"])
-
-# Get the latest month (true max, not alphabetical)
-latest_month = df["MONTH"].max()
-
-# Filter to latest month only
-df = df[df["MONTH"] == latest_month]
-
-# Convert MONTH back to string for matching sheet headers
-df["MONTH"] = df["MONTH"].dt.strftime("%B %Y")
-latest_month_str = df["MONTH"].iloc[0]
-
-# ---- Connect to Google Sheets ----
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-if not GOOGLE_CREDENTIALS_PATH:
-    raise ValueError("GOOGLE_CREDENTIALS_PATH env var is required for Google Sheets access")
-creds = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_PATH, scopes=SCOPES)
-client = gspread.authorize(creds)
-
-spreadsheet = client.open("KPI NEW AUTOMATED")   #update
-sheet = spreadsheet.worksheet("KPI")    #update
-
-# ---- Map KPI -> value for this latest month ----
-latest_map = dict(zip(df["KPI_DISPLAY"], df["KPI_VALUE"]))
+# ---- Map KPI display name -> value for this latest month (unmapped KPIs are skipped) ----
+display_to_value = {
+    KPI_MAPPING[k]: v
+    for k, v in zip(df["KPI_NAME"].to_numpy(), df["KPI_VALUE"].to_numpy())
+    if k in KPI_MAPPING
+}
 
-# Get sheet headers (row 1, months)
-headers = sheet.row_values(1)
+# ---- Add total_customers as sum of prod + cons (straight into the map, no extra frame row) ----
+customer_mask = df["KPI_NAME"].isin(["total_consumption_customers", "total_production_customers"]).to_numpy()
+if customer_mask.any():
+    display_to_value[KPI_MAPPING["total_customers"]] = df.loc[customer_mask, "KPI_VALUE"].sum()
 
 # Ensure latest month string is present
 if latest_month_str not in headers:
@@ -195,55 +211,79 @@ if latest_month_str not in headers:
 # Column index for latest month
 month_col = headers.index(latest_month_str) + 1  # gspread is 1-based
 
-# Get all KPI names (col A) and Types (col B)
-sheet_kpis = sheet.col_values(1)
-sheet_types = sheet.col_values(2)
-
 # Only update the specific cells for rows marked Automated.
 # Do not write blanks anywhere to avoid wiping formulas/values in Manual/Fixed/Calculated rows.
-updated_count = 0
-skipped_count = 0
-
 from gspread.exceptions import APIError
 import time
 
-BATCH_SIZE = 200  # safe chunk size to avoid 429
-pending_updates = []  # list of {"range": A1, "values": [[value]]}
-
-for row_index, (kpi, kpi_type) in enumerate(zip(sheet_kpis[1:], sheet_types[1:]), start=2):  # rows start at 2
-    if kpi_type == "Automated" and kpi in latest_map:
-        value = latest_map[kpi]
-        # Skip NaN/Inf/None to avoid Google Sheets JSON errors
-        if value is None or (isinstance(value, float) and (np.isnan(value) or np.isinf(value))):
-            skipped_count += 1
-            print(f"⏭️  Skipped row {row_index} → {kpi} (NaN/Inf)")
-            continue
-        a1 = rowcol_to_a1(row_index, month_col)
-        pending_updates.append({"range": a1, "values": [[value]]})
-        updated_count += 1
-        print(f"✅ Queued row {row_index} → {kpi}: {value}")
-    else:
-        # Preserve any non-Automated types (e.g., Calculated, Manual, Fixed)
-        skipped_count += 1
-        print(f"⏭️  Skipped row {row_index} → {kpi} (Type: {kpi_type})")
-
-# Flush in batches
-for i in range(0, len(pending_updates), BATCH_SIZE):
-    chunk = pending_updates[i:i + BATCH_SIZE]
-    # batch_update accepts a list of request bodies; each with single-cell range and values
+# Column letter for the latest month (e.g. "AB1" -> "AB")
+col_letter = rowcol_to_a1(1, month_col)[:-1]
+
+# One row per sheet row from 2 onwards (Type column can be shorter than the KPI column)
+kpi_names = sheet_kpis[1:]
+kpi_types = sheet_types[1:len(sheet_kpis)]
+sdf = pd.DataFrame({
+    "row": np.arange(2, len(kpi_names) + 2),
+    "kpi": kpi_names,
+    "type": kpi_types + [""] * (len(kpi_names) - len(kpi_types)),
+})
+raw_vals = sdf["kpi"].map(display_to_value)
+# Text values are written as they are; only the rest is coerced to numbers
+is_text = raw_vals.map(lambda v: isinstance(v, str) and v.strip() != "").to_numpy(dtype=bool)
+num_vals = pd.to_numeric(raw_vals.mask(is_text), errors="coerce")
+sdf["val"] = num_vals.astype(object).mask(is_text, raw_vals)
+
+automated = (sdf["type"] == "Automated").to_numpy()
+# Skip NaN/Inf/None (and KPIs missing from the data) to avoid Google Sheets JSON errors
+has_value = is_text | np.isfinite(num_vals.to_numpy(dtype=float, na_value=np.nan))
+to_write = automated & has_value
+
+# Collapse consecutive Automated rows into one range each (e.g. G5, G6, G7 -> G5:G7)
+write_rows = sdf["row"].to_numpy()[to_write]
+write_vals = sdf["val"].to_numpy()[to_write]
+run_starts = np.flatnonzero(np.diff(write_rows) != 1) + 1
+pending_updates = [
+    {
+        "range": f"{col_letter}{rows[0]}:{col_letter}{rows[-1]}",
+        "values": [[value] for value in vals.tolist()],
+    }
+    for rows, vals in zip(np.split(write_rows, run_starts), np.split(write_vals, run_starts))
+    if len(rows)
+]
+
+updated_count = int(to_write.sum())
+missing_count = int(automated.sum()) - updated_count
+preserved_count = len(sdf) - int(automated.sum())
+
+if logger.isEnabledFor(logging.DEBUG):
+    for row_index, kpi, kpi_type, value, is_automated, is_written in zip(
+        sdf["row"], sdf["kpi"], sdf["type"], sdf["val"], automated, to_write
+    ):
+        if is_written:
+            logger.debug(f"✅ Queued row {row_index} → {kpi}: {value}")
+        elif is_automated:
+            logger.debug(f"⏭️  Skipped row {row_index} → {kpi} (no value/NaN/Inf)")
+        else:
+            # Preserve any non-Automated types (e.g., Calculated, Manual, Fixed)
+            logger.debug(f"⏭️  Skipped row {row_index} → {kpi} (Type: {kpi_type})")
+
+# Write all runs in a single batch request
+if pending_updates:
     try:
-        sheet.batch_update(chunk, value_input_option="RAW")
+        sheet.batch_update(pending_updates, value_input_option="RAW")
     except APIError as e:
         if "429" in str(e):
             time.sleep(2)
-            sheet.batch_update(chunk, value_input_option="RAW")
+            sheet.batch_update(pending_updates, value_input_option="RAW")
         else:
             raise
 
-print(f"\n Summary:")
-print(f"   • Updated: {updated_count} Automated fields")
-print(f"   • Preserved (untouched): {skipped_count} non-Automated fields")
-
-print(f"\n Latest month ({latest_month_str}) values written only for Automated rows in column {latest_month_str}.")
-print(f" Calculated/Manual/Fixed fields preserved - no cells overwritten.")
+logger.info(
+    f"\n Summary:"
+    f"\n   • Updated: {updated_count} Automated fields"
+    f"\n   • Skipped: {missing_count} Automated fields with no/invalid value"
+    f"\n   • Preserved (untouched): {preserved_count} non-Automated fields"
+    f"\n\n Latest month ({latest_month_str}) values written only for Automated rows in column {latest_month_str}."
+    f"\n Calculated/Manual/Fixed fields preserved - no cells overwritten."
+)
 
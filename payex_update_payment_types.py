@@ -1,42 +1,65 @@
 import os
+import asyncio
 import base64
+import logging
+import logging.handlers
 import tempfile
 import time
+import httpx
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
 import snowflake.connector
 import urllib3
-from cryptography.hazmat.primitives import serialization
 from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
 from urllib3.util.ssl_ import create_urllib3_context
+from snowflake_auth import load_private_key
 import ssl
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Per-customer lines are DEBUG (LOG_LEVEL=DEBUG to see them) and are buffered in memory
+# rather than written one by one; the buffer is flushed by the INFO progress line logged
+# every PROGRESS_EVERY customers (or when full / at exit).
+PROGRESS_EVERY = 500
+_log_target = logging.StreamHandler()
+_log_target.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+logging.basicConfig(
+    level=logging.INFO,
+    handlers=[logging.handlers.MemoryHandler(capacity=500, flushLevel=logging.INFO, target=_log_target)],
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)  # httpx logs every request at INFO
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 # Optional: suppress SSL warnings (since we're disabling verification)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# --- TLS context that disables verification but loads client cert ---
+def build_ssl_context(certfile, keyfile):
+    ctx = create_urllib3_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    ctx.load_cert_chain(certfile=certfile, keyfile=keyfile)
+    return ctx
+
+
 # --- TLS Adapter that disables verification but loads client cert ---
 class TLSAdapter(HTTPAdapter):
     def __init__(self, certfile, keyfile, **kwargs):
         self.certfile = certfile
         self.keyfile = keyfile
+        # Built once and shared by the pool and proxy managers (must exist before HTTPAdapter.__init__)
+        self._ctx = build_ssl_context(certfile, keyfile)
         super().__init__(**kwargs)
 
     def init_poolmanager(self, *args, **kwargs):
-        ctx = create_urllib3_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        ctx.load_cert_chain(certfile=self.certfile, keyfile=self.keyfile)
-        kwargs['ssl_context'] = ctx
+        kwargs['ssl_context'] = self._ctx
         return super().init_poolmanager(*args, **kwargs)
 
     def proxy_manager_for(self, *args, **kwargs):
-        ctx = create_urllib3_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        ctx.load_cert_chain(certfile=self.certfile, keyfile=self.keyfile)
-        kwargs['ssl_context'] = ctx
+        kwargs['ssl_context'] = self._ctx
         return super().proxy_manager_for(*args, **kwargs)
 
 
@@ -62,127 +85,155 @@ def get_session():
     return session, base_url, company, token, cert_file.name, key_file.name
 
 
-def build_session(token, cert_path, key_path):
-    s = requests.Session()
-    s.headers.update({'Authorization': f'Bearer {token}'})
-    adapter = TLSAdapter(cert_path, key_path)
-    s.mount("https://", adapter)
-    return s
+# Consent types reported by PayEx, in the order of the is_* columns in PAYEX_PAYMENT_TYPES
+CONSENT_FLAGS = (
+    "Autogiro", "Avtalegiro", "Betalingsservice",
+    "RecurringCard", "RecurringInvoiceToken", "EInvoice",
+    "Kivra", "EBoks"
+)
 
 
-def fetch_payment_types_serial(session, base_url, company, customer_ids):
-    consent_flags = [
-        "Autogiro", "Avtalegiro", "Betalingsservice",
-        "RecurringCard", "RecurringInvoiceToken", "EInvoice",
-        "Kivra", "EBoks"
-    ]
+# Bit i of a record's consent bitmap is set when CONSENT_FLAGS[i] is active
+CONSENT_BITS = {flag: 1 << i for i, flag in enumerate(CONSENT_FLAGS)}
+
 
+def build_record(data):
+    consents = data.get("activeConsents", []) or []
+    consent_flags = 0
+    for c in consents:
+        consent_flags |= CONSENT_BITS.get(c, 0)
+    return (
+        int(data.get("customerNo")),
+        data.get("name"),
+        data.get("emailAddress"),
+        ",".join(consents),
+        consent_flags,
+        data.get("legalStatus")
+    )
+
+
+def fetch_payment_types_serial(session, base_url, company, customer_ids):
     records = []
+    total = len(customer_ids)
+    not_found = errors = 0
     for idx, cid in enumerate(customer_ids, start=1):
         url = f"{base_url}/customer/v1/{company}/customers/{cid}"
         try:
             response = session.get(url, verify=False)
             if response.status_code == 200:
-                data = response.json()
-                consents = data.get("activeConsents", [])
-                record = (
-                    int(data.get("customerNo")),
-                    data.get("name"),
-                    data.get("emailAddress"),
-                    ",".join(consents),
-                    *[(1 if c in consents else 0) for c in consent_flags],
-                    data.get("legalStatus")
-                )
+                data = orjson.loads(response.content)
+                record = build_record(data)
                 records.append(record)
-                print(f"{idx}/{len(customer_ids)} → {cid} → Record Found")
+                logger.debug(f"{idx}/{total} → {cid} → Record Found")
             elif response.status_code == 404:
-                print(f"{idx}/{len(customer_ids)} → {cid} → Not found (404)")
+                not_found += 1
+                logger.debug(f"{idx}/{total} → {cid} → Not found (404)")
             else:
-                print(f"{idx}/{len(customer_ids)} → {cid} → Status: {response.status_code}")
+                errors += 1
+                logger.debug(f"{idx}/{total} → {cid} → Status: {response.status_code}")
         except Exception as e:
-            print(f"{idx}/{len(customer_ids)} → {cid} → ERROR: {e}")
+            errors += 1
+            logger.debug(f"{idx}/{total} → {cid} → ERROR: {e}")
+        if idx % PROGRESS_EVERY == 0 or idx == total:
+            logger.info(f"{idx}/{total} processed: {len(records)} found, {not_found} not found, {errors} errors")
         time.sleep(1.0)
     return records
 
 
-def fetch_one_customer(cid, token, cert_path, key_path, base_url, company, consent_flags, delay_s):
+class RateLimiter:
+    """Token bucket shared by all fetch tasks; rps <= 0 disables limiting."""
+    def __init__(self, rps):
+        self.rps = rps
+        self.capacity = max(1.0, rps)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rps <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rps)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rps)
+
+
+async def fetch_one_customer(client, semaphore, rate_limiter, cid, base_url, company):
     url = f"{base_url}/customer/v1/{company}/customers/{cid}"
-    try:
-        session = build_session(token, cert_path, key_path)
-        resp = session.get(url, verify=False)
-        if resp.status_code == 200:
-            data = resp.json()
-            consents = data.get("activeConsents", [])
-            record = (
-                int(data.get("customerNo")),
-                data.get("name"),
-                data.get("emailAddress"),
-                ",".join(consents),
-                *[(1 if c in consents else 0) for c in consent_flags],
-                data.get("legalStatus")
-            )
-            return (cid, True, record, None)
-        elif resp.status_code == 404:
-            return (cid, False, None, None)
-        else:
-            return (cid, False, None, f"Status: {resp.status_code}")
-    except Exception as e:
-        return (cid, False, None, str(e))
-    finally:
-        if delay_s > 0:
-            time.sleep(delay_s)
+    async with semaphore:
+        try:
+            await rate_limiter.acquire()
+            resp = await client.get(url)
+            if resp.status_code == 200:
+                data = orjson.loads(resp.content)
+                record = build_record(data)
+                return (cid, True, record, None)
+            elif resp.status_code == 404:
+                return (cid, False, None, None)
+            else:
+                return (cid, False, None, f"Status: {resp.status_code}")
+        except Exception as e:
+            return (cid, False, None, str(e))
+
 
+async def _fetch_payment_types_async(token, cert_path, key_path, base_url, company, customer_ids, max_workers, max_rps):
+    # Same TLS setup as TLSAdapter: client certificate, no server verification
+    ctx = build_ssl_context(cert_path, key_path)
 
-def fetch_payment_types_parallel(token, cert_path, key_path, base_url, company, customer_ids, max_workers, delay_s):
-    consent_flags = [
-        "Autogiro", "Avtalegiro", "Betalingsservice",
-        "RecurringCard", "RecurringInvoiceToken", "EInvoice",
-        "Kivra", "EBoks"
-    ]
     records = []
     total = len(customer_ids)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {
-            executor.submit(
-                fetch_one_customer,
-                cid,
-                token,
-                cert_path,
-                key_path,
-                base_url,
-                company,
-                consent_flags,
-                delay_s,
-            ): cid for cid in customer_ids
-        }
-        done_count = 0
-        for future in as_completed(futures):
-            cid = futures[future]
-            done_count += 1
-            try:
-                _cid, ok, record, err = future.result()
-                if ok and record is not None:
-                    records.append(record)
-                    print(f"{done_count}/{total} → {cid} → Record Found")
-                elif err is None:
-                    print(f"{done_count}/{total} → {cid} → Not found or no change")
-                else:
-                    print(f"{done_count}/{total} → {cid} → {err}")
-            except Exception as e:
-                print(f"{done_count}/{total} → {cid} → ERROR: {e}")
+    not_found = errors = 0
+    # max_workers bounds the number of requests in flight; HTTP/2 multiplexes them over few connections
+    semaphore = asyncio.Semaphore(max_workers)
+    rate_limiter = RateLimiter(max_rps)
+    limits = httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers)
+    async with httpx.AsyncClient(
+        verify=ctx,
+        http2=True,
+        headers={'Authorization': f'Bearer {token}'},
+        limits=limits,
+    ) as client:
+        tasks = [
+            asyncio.create_task(
+                fetch_one_customer(client, semaphore, rate_limiter, cid, base_url, company)
+            )
+            for cid in customer_ids
+        ]
+        for done_count, task in enumerate(asyncio.as_completed(tasks), start=1):
+            cid, ok, record, err = await task
+            if ok and record is not None:
+                records.append(record)
+                logger.debug(f"{done_count}/{total} → {cid} → Record Found")
+            elif err is None:
+                not_found += 1
+                logger.debug(f"{done_count}/{total} → {cid} → Not found or no change")
+            else:
+                errors += 1
+                logger.debug(f"{done_count}/{total} → {cid} → {err}")
+            if done_count % PROGRESS_EVERY == 0 or done_count == total:
+                logger.info(f"{done_count}/{total} processed: {len(records)} found, {not_found} not found, {errors} errors")
     return records
 
 
-def merge_into_snowflake(records):
-    if not records:
-        print("No records to upsert.")
-        return
+def fetch_payment_types_parallel(token, cert_path, key_path, base_url, company, customer_ids, max_workers, max_rps):
+    return asyncio.run(
+        _fetch_payment_types_async(
+            token, cert_path, key_path, base_url, company, customer_ids, max_workers, max_rps
+        )
+    )
 
+
+def connect_snowflake():
+    load_dotenv()
     private_key_path = os.getenv("SNOWFLAKE_PRIVATE_KEY_PATH", os.path.join(os.path.dirname(__file__), "rsa_key.p8"))
-    with open(private_key_path, "rb") as key_file:
-        private_key = serialization.load_pem_private_key(key_file.read(), password=None)
+    private_key = load_private_key(private_key_path)
 
-    conn = snowflake.connector.connect(
+    return snowflake.connector.connect(
         user=os.getenv("SNOWFLAKE_USER"),
         account=os.getenv("SNOWFLAKE_ACCOUNT"),
         private_key=private_key,
@@ -190,120 +241,101 @@ def merge_into_snowflake(records):
         database=os.getenv("SNOWFLAKE_DATABASE"),
         schema=os.getenv("SNOWFLAKE_SCHEMA")
     )
-    cs = conn.cursor()
 
+
+def fetch_customer_ids_from_snowflake(table, start_idx, batch_size):
+    conn = connect_snowflake()
+    cs = conn.cursor()
     try:
-        print(f"Starting MERGE of {len(records)} records into PAYEX_PAYMENT_TYPES...")
-        merge_start_ts = time.time()
-        merge_sql = """
-        MERGE INTO PAYEX_PAYMENT_TYPES tgt
-        USING (
-            SELECT
-                %s AS customer_id,
-                %s AS customer_name,
-                %s AS customer_email,
-                %s AS active_consents,
-                %s AS is_autogiro, %s AS is_avtalegiro, %s AS is_betalingsservice,
-                %s AS is_recurring_card, %s AS is_recurring_invoice_token,
-                %s AS is_einvoice, %s AS is_kivra, %s AS is_eboks,
-                %s AS status
-        ) src
-        ON tgt.customer_id = src.customer_id
-        WHEN MATCHED AND (
-            NVL(tgt.customer_name, '') <> NVL(src.customer_name, '') OR
-            NVL(tgt.customer_email, '') <> NVL(src.customer_email, '') OR
-            NVL(tgt.active_consents, '') <> NVL(src.active_consents, '') OR
-            NVL(tgt.is_autogiro, 0) <> NVL(src.is_autogiro, 0) OR
-            NVL(tgt.is_avtalegiro, 0) <> NVL(src.is_avtalegiro, 0) OR
-            NVL(tgt.is_betalingsservice, 0) <> NVL(src.is_betalingsservice, 0) OR
-            NVL(tgt.is_recurring_card, 0) <> NVL(src.is_recurring_card, 0) OR
-            NVL(tgt.is_recurring_invoice_token, 0) <> NVL(src.is_recurring_invoice_token, 0) OR
-            NVL(tgt.is_einvoice, 0) <> NVL(src.is_einvoice, 0) OR
-            NVL(tgt.is_kivra, 0) <> NVL(src.is_kivra, 0) OR
-            NVL(tgt.is_eboks, 0) <> NVL(src.is_eboks, 0) OR
-            NVL(tgt.status, '') <> NVL(src.status, '')
-        ) THEN UPDATE SET
-            customer_name = src.customer_name,
-            customer_email = src.customer_email,
-            active_consents = src.active_consents,
-            is_autogiro = src.is_autogiro,
-            is_avtalegiro = src.is_avtalegiro,
-            is_betalingsservice = src.is_betalingsservice,
-            is_recurring_card = src.is_recurring_card,
-            is_recurring_invoice_token = src.is_recurring_invoice_token,
-            is_einvoice = src.is_einvoice,
-            is_kivra = src.is_kivra,
-            is_eboks = src.is_eboks,
-            status = src.status
-        WHEN NOT MATCHED THEN INSERT (
-            customer_id, customer_name, customer_email, active_consents,
-            is_autogiro, is_avtalegiro, is_betalingsservice,
-            is_recurring_card, is_recurring_invoice_token,
-            is_einvoice, is_kivra, is_eboks, status
-        ) VALUES (
-            src.customer_id, src.customer_name, src.customer_email, src.active_consents,
-            src.is_autogiro, src.is_avtalegiro, src.is_betalingsservice,
-            src.is_recurring_card, src.is_recurring_invoice_token,
-            src.is_einvoice, src.is_kivra, src.is_eboks, src.status
+        cs.execute(
+            f"SELECT CUSTOMERID FROM {table} WHERE CUSTOMERID IS NOT NULL ORDER BY CUSTOMERID LIMIT %s OFFSET %s",
+            (batch_size, start_idx),
         )
-        """
-        cs.executemany(merge_sql, records)
-        conn.commit()
-        merge_duration = time.time() - merge_start_ts
-        print(f"Upserted {len(records)} records into PAYEX_PAYMENT_TYPES. MERGE duration: {merge_duration:.2f}s")
+        # Arrow result batches; only the requested window is ever transferred
+        return [
+            cid
+            for batch in cs.fetch_pandas_batches()
+            for cid in batch["CUSTOMERID"].astype(str).tolist()
+        ]
     finally:
         cs.close()
         conn.close()
 
 
+def merge_into_snowflake(records):
+    # PAYEX_UPSERT_MODE=rowmerge: stage the batch and run a single MERGE rather than one per record
+    bulk_stage_upsert(records, mode="merge")
+
+
 def bulk_stage_upsert(records, mode="merge"):
     if not records:
-        print("No records to upsert (stage mode).")
+        logger.info("No records to upsert (stage mode).")
         return
 
-    cols = [
-        "customer_id", "customer_name", "customer_email", "active_consents",
-        "is_autogiro", "is_avtalegiro", "is_betalingsservice",
-        "is_recurring_card", "is_recurring_invoice_token",
-        "is_einvoice", "is_kivra", "is_eboks", "status",
-    ]
-    df = pd.DataFrame(records, columns=cols)
-
-    private_key_path = os.getenv("SNOWFLAKE_PRIVATE_KEY_PATH", os.path.join(os.path.dirname(__file__), "rsa_key.p8"))
-    with open(private_key_path, "rb") as key_file:
-        private_key = serialization.load_pem_private_key(key_file.read(), password=None)
-
-    conn = snowflake.connector.connect(
-        user=os.getenv("SNOWFLAKE_USER"),
-        account=os.getenv("SNOWFLAKE_ACCOUNT"),
-        private_key=private_key,
-        warehouse=os.getenv("SNOWFLAKE_WAREHOUSE"),
-        database=os.getenv("SNOWFLAKE_DATABASE"),
-        schema=os.getenv("SNOWFLAKE_SCHEMA")
+    schema = pa.schema([
+        ("customer_id", pa.int64()),
+        ("customer_name", pa.string()),
+        ("customer_email", pa.string()),
+        ("active_consents", pa.string()),
+        ("consent_flags", pa.uint8()),
+        ("status", pa.string()),
+    ])
+    # Build the table column-wise from the record tuples, typed up front
+    table = pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(zip(*records), schema)],
+        schema=schema,
     )
+
+    conn = connect_snowflake()
     cs = conn.cursor()
+    parquet_path = None
 
     try:
         stage_table = "PAYEX_PAYMENT_TYPES_STAGE"
-        print(f"Staging {len(df)} records into {stage_table}…")
+        logger.info(f"Staging {table.num_rows} records into {stage_table}…")
 
-        cs.execute(f"CREATE OR REPLACE TEMPORARY TABLE {stage_table} LIKE PAYEX_PAYMENT_TYPES")
+        # Same columns as PAYEX_PAYMENT_TYPES, but the eight is_* flags travel as one bitmap
+        cs.execute(
+            f"""
+            CREATE OR REPLACE TEMPORARY TABLE {stage_table} AS
+            SELECT customer_id, customer_name, customer_email, active_consents,
+                   0::NUMBER(3,0) AS consent_flags, status
+            FROM PAYEX_PAYMENT_TYPES
+            WHERE FALSE
+            """
+        )
+        stage_source = f"""
+            SELECT
+                customer_id, customer_name, customer_email, active_consents,
+                BITAND(consent_flags, 1) AS is_autogiro,
+                BITAND(BITSHIFTRIGHT(consent_flags, 1), 1) AS is_avtalegiro,
+                BITAND(BITSHIFTRIGHT(consent_flags, 2), 1) AS is_betalingsservice,
+                BITAND(BITSHIFTRIGHT(consent_flags, 3), 1) AS is_recurring_card,
+                BITAND(BITSHIFTRIGHT(consent_flags, 4), 1) AS is_recurring_invoice_token,
+                BITAND(BITSHIFTRIGHT(consent_flags, 5), 1) AS is_einvoice,
+                BITAND(BITSHIFTRIGHT(consent_flags, 6), 1) AS is_kivra,
+                BITAND(BITSHIFTRIGHT(consent_flags, 7), 1) AS is_eboks,
+                status
+            FROM {stage_table}
+        """
 
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as tmp:
-            csv_path = tmp.name
-            df.to_csv(csv_path, index=False)
+        with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as tmp:
+            parquet_path = tmp.name
+        pq.write_table(table, parquet_path, compression="snappy")
 
-        cs.execute(f"PUT file://{csv_path} @%{stage_table} OVERWRITE = TRUE")
+        # Parquet is already compressed, so upload as-is and load by column name
+        cs.execute(f"PUT file://{parquet_path} @%{stage_table} OVERWRITE = TRUE AUTO_COMPRESS = FALSE")
         cs.execute(
             f"""
             COPY INTO {stage_table}
             FROM @%{stage_table}
-            FILE_FORMAT = (TYPE = CSV FIELD_OPTIONALLY_ENCLOSED_BY='"' SKIP_HEADER = 1)
+            FILE_FORMAT = (TYPE = PARQUET)
+            MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
             """
         )
 
         if mode == "replace":
-            print("Running DELETE + INSERT from stage…")
+            logger.info("Running DELETE + INSERT from stage…")
             delete_sql = f"""
             DELETE FROM PAYEX_PAYMENT_TYPES tgt
             USING {stage_table} src
@@ -318,15 +350,20 @@ def bulk_stage_upsert(records, mode="merge"):
                 is_recurring_card, is_recurring_invoice_token,
                 is_einvoice, is_kivra, is_eboks, status
             )
-            SELECT {', '.join(cols)} FROM {stage_table}
+            SELECT
+                customer_id, customer_name, customer_email, active_consents,
+                is_autogiro, is_avtalegiro, is_betalingsservice,
+                is_recurring_card, is_recurring_invoice_token,
+                is_einvoice, is_kivra, is_eboks, status
+            FROM ({stage_source})
             """
             cs.execute(insert_sql)
-            print(f"Replaced rows for {len(df)} customers.")
+            logger.info(f"Replaced rows for {table.num_rows} customers.")
         else:
-            print("Running single MERGE from stage…")
+            logger.info("Running single MERGE from stage…")
             merge_sql = f"""
             MERGE INTO PAYEX_PAYMENT_TYPES tgt
-            USING {stage_table} src
+            USING ({stage_source}) src
             ON tgt.customer_id = src.customer_id
             WHEN MATCHED AND (
                 NVL(tgt.customer_name, '') <> NVL(src.customer_name, '') OR
@@ -367,43 +404,61 @@ def bulk_stage_upsert(records, mode="merge"):
             )
             """
             cs.execute(merge_sql)
-            print(f"Merged rows for {len(df)} customers.")
+            logger.info(f"Merged rows for {table.num_rows} customers.")
 
         conn.commit()
     finally:
-        try:
-            os.remove(csv_path)
-        except Exception:
-            pass
+        if parquet_path:
+            try:
+                os.remove(parquet_path)
+            except Exception:
+                pass
         cs.close()
         conn.close()
 
 def main():
-    # Input file should contain a column named CUSTOMERID
-    input_path = os.getenv("PAYEX_CUSTOMER_ID_CSV")
-    if not input_path:
-        raise ValueError("PAYEX_CUSTOMER_ID_CSV env var is required (path to CSV with CUSTOMERID column)")
-
-    df = pd.read_csv(input_path)
-    customer_ids = df['CUSTOMERID'].dropna().astype(str).tolist()
-
     # Batching via env vars
     start_idx = int(os.getenv("PAYEX_BATCH_START", "77000"))
     batch_size = int(os.getenv("PAYEX_BATCH_SIZE", "5000"))
-    end_idx = min(start_idx + batch_size, len(customer_ids))
-    batch_ids = customer_ids[start_idx:end_idx]
 
-    print(f"Loaded {len(customer_ids)} customer IDs from {input_path}.")
-    print(f"Processing indices {start_idx}:{end_idx} (batch size {len(batch_ids)}).")
+    # Customer IDs come from a Snowflake table (PAYEX_CUSTOMER_ID_TABLE) or a CSV file (PAYEX_CUSTOMER_ID_CSV)
+    ids_table = os.getenv("PAYEX_CUSTOMER_ID_TABLE")
+    if ids_table:
+        batch_ids = fetch_customer_ids_from_snowflake(ids_table, start_idx, batch_size)
+        logger.info(f"Loaded {len(batch_ids)} customer IDs from {ids_table}.")
+        logger.info(f"Processing indices {start_idx}:{start_idx + len(batch_ids)} (batch size {len(batch_ids)}).")
+    else:
+        # Input file should contain a column named CUSTOMERID
+        input_path = os.getenv("PAYEX_CUSTOMER_ID_CSV")
+        if not input_path:
+            raise ValueError(
+                "PAYEX_CUSTOMER_ID_CSV env var is required (path to CSV with CUSTOMERID column) "
+                "unless PAYEX_CUSTOMER_ID_TABLE is set"
+            )
+
+        df = pd.read_csv(input_path, usecols=["CUSTOMERID"], dtype={"CUSTOMERID": str})
+        customer_ids = df['CUSTOMERID'].dropna()
+
+        # Slice the batch window before converting to Python strings
+        end_idx = min(start_idx + batch_size, len(customer_ids))
+        batch_ids = customer_ids.iloc[start_idx:end_idx].tolist()
+
+        logger.info(f"Loaded {len(customer_ids)} customer IDs from {input_path}.")
+        logger.info(f"Processing indices {start_idx}:{end_idx} (batch size {len(batch_ids)}).")
 
     session, base_url, company, token, cert_path, key_path = get_session()
 
     max_workers = int(os.getenv("PAYEX_MAX_WORKERS", "10"))
+    # Global request rate cap (0 = unlimited). PAYEX_REQUEST_DELAY is still honoured as
+    # "each worker waits this long between requests" when no explicit rate is set.
+    max_rps = float(os.getenv("PAYEX_MAX_RPS", "0"))
     request_delay = float(os.getenv("PAYEX_REQUEST_DELAY", "0"))
+    if max_rps <= 0 and request_delay > 0:
+        max_rps = max_workers / request_delay
 
     if max_workers > 1:
         records = fetch_payment_types_parallel(
-            token, cert_path, key_path, base_url, company, batch_ids, max_workers, request_delay
+            token, cert_path, key_path, base_url, company, batch_ids, max_workers, max_rps
         )
     else:
         records = fetch_payment_types_serial(session, base_url, company, batch_ids)
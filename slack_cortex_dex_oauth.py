@@ -4,27 +4,93 @@ Integrates Slack with Snowflake Cortex Agent for natural language queries about
 Supports OAuth installation for multiple workspaces - "Add to Slack" functionality.
 """
 import os
+import random
 import json
 import logging
 import re
+import sys
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.flask import SlackRequestHandler
 from slack_bolt.oauth import OAuthFlow
 from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from flask import Flask, request, make_response
 from urllib.parse import quote_plus
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import time
-from collections import deque
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+
+try:
+    import orjson
+    _loads = orjson.loads
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:  # orjson is optional; fall back to the stdlib parser
+    _loads = json.loads
+
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False)
 
 load_dotenv()
 
 # Simple in-memory deduplication for slash commands
-# Track recent commands to prevent duplicate processing
-_recent_commands = deque(maxlen=100)  # Keep last 100 commands
-_command_lock = {}  # Track commands being processed
+# Maps command key -> ('processing' | 'done', first seen), oldest first; entries expire after
+# _COMMAND_STATE_TTL seconds and the map is capped so it can't grow forever
+_command_state = OrderedDict()
+_COMMAND_STATE_MAX = 256
+_COMMAND_STATE_TTL = 10
+_command_state_lock = threading.Lock()
+
+
+def claim_command(command_key):
+    """
+    Record a command as being processed.
+    Returns the existing state ('processing' | 'done') if the key was seen within the TTL, else None.
+    """
+    now = time.monotonic()
+    with _command_state_lock:
+        # Keys are in insertion order, so expired entries are all at the front
+        while _command_state:
+            _, seen_at = next(iter(_command_state.values()))
+            if now - seen_at < _COMMAND_STATE_TTL:
+                break
+            _command_state.popitem(last=False)
+        
+        entry = _command_state.get(command_key)
+        if entry:
+            return entry[0]
+        
+        # Mark as being processed, evicting the oldest keys past the cap
+        _command_state[command_key] = ('processing', now)
+        while len(_command_state) > _COMMAND_STATE_MAX:
+            _command_state.popitem(last=False)
+    return None
+
+
+def mark_command_done(command_key):
+    """Keep the key around as 'done' so Slack retries of this command are still ignored"""
+    with _command_state_lock:
+        entry = _command_state.get(command_key)
+        if entry:
+            _command_state[command_key] = ('done', entry[1])
+
+# Background pool for Cortex calls, so message/action handlers return to Bolt right away
+# instead of holding a worker for the whole agent round-trip (which also triggers Slack retries)
+_agent_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cortex")
+# How long /dex waits for a quick answer before posting a "processing" message to replace later;
+# kept short so slow questions still see the processing banner almost immediately. Live agent
+# answers take far longer (see AGENT_LATENCY_TARGET), so in practice only cached answers beat it
+FAST_ANSWER_TIMEOUT = 0.5
+# (connect, read) timeout for response_url posts; they run on the Cortex pool and listener threads,
+# so a slow or hung Slack endpoint must not hold one of those workers indefinitely
+RESPONSE_URL_TIMEOUT = (5, 10)
 
 # OAuth Configuration (for multi-workspace support)
 SLACK_CLIENT_ID = os.getenv("CLIENT_ID_DEX") or os.getenv("SLACK_CLIENT_ID")
@@ -38,6 +104,19 @@ if SLACK_BOT_URL and not SLACK_BOT_URL.startswith("http"):
 # Cortex Agent configuration (shared across all workspaces)
 AGENT_ENDPOINT = os.getenv("AGENT_ENDPOINT")
 PAT = os.getenv("PAT")  # Programmatic Access Token from Snowflake
+# Request headers are fixed for the lifetime of the process, so build them once
+AGENT_HEADERS = {
+    "Authorization": f"Bearer {PAT}",
+    "Content-Type": "application/json"
+} if PAT else None
+# Pooled session so repeat questions reuse the TCP/TLS connection to the agent endpoint;
+# the headers are bound to it once instead of being passed (and merged) on every call
+AGENT_SESSION = requests.Session()
+AGENT_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+if AGENT_HEADERS:
+    AGENT_SESSION.headers.update(AGENT_HEADERS)
+# Mean agent latency (seconds) above which fewer agent calls are allowed to run at once
+AGENT_LATENCY_TARGET = float(os.getenv("AGENT_LATENCY_TARGET", "30"))
 
 # Channel where bot is active (optional - can listen to all channels)
 TARGET_CHANNEL = os.getenv("SLACK_CHANNEL", "ask-dex")
@@ -45,6 +124,9 @@ TARGET_CHANNEL = os.getenv("SLACK_CHANNEL", "ask-dex")
 # Custom emoji for verified badge (use your custom emoji name, e.g., ":verified:")
 # Leave empty or use standard emoji like ":white_check_mark:"
 VERIFIED_EMOJI = os.getenv("VERIFIED_EMOJI", ":verified:")
+# Fixed labels built from the emoji once instead of per render
+VERIFIED_LABEL = f"{VERIFIED_EMOJI} answer accuracy verified by agent owner"
+VERIFIED_QUERY_SUFFIX = f" {VERIFIED_EMOJI} Answer accuracy verified by agent owner"
 
 # Workspace token storage file (JSON file - can upgrade to database later)
 WORKSPACE_TOKENS_FILE = "workspace_tokens.json"
@@ -226,11 +308,11 @@ def set_bot_token(context, next_):
                 installation = installation_store.find_installation(team_id=team_id)
                 if installation and installation.bot_token:
                     context["bot_token"] = installation.bot_token
-                    # Update app client with workspace-specific token
-                    from slack_sdk import WebClient
+                    if installation.bot_user_id:
+                        context["bot_user_id"] = installation.bot_user_id
+                    # Workspace-specific client for this request only; app.client is shared by
+                    # concurrent requests from every workspace, so it is never swapped
                     context["client"] = WebClient(token=installation.bot_token)
-                    # Also update app.client for backward compatibility
-                    app.client = context["client"]
                 else:
                     logger.warning(f"No installation found for workspace: {team_id}")
             except Exception as lookup_error:
@@ -247,21 +329,198 @@ def set_bot_token(context, next_):
 handler = SlackRequestHandler(app)
 
 
+# Patterns that indicate agent thinking/reasoning (not the final answer)
+THINKING_PATTERNS = (
+    'the user is asking',
+    'let me query',
+    'i need to use',
+    'i have the sql results',
+    'wait, this seems',
+    'actually, looking at',
+    'let me check',
+    'this seems to be',
+    'this is quantitative',
+    'i need to',
+    'let me',
+    'this seems incorrect',
+    'looking at the',
+    'check if there',
+    'the results show',
+    'earliest termination',
+    'latest termination',
+    'spanning from'
+)
+# One alternation scan per section instead of a Python-level `in` check per pattern
+_THINKING_RE = re.compile('|'.join(map(re.escape, THINKING_PATTERNS)))
+# Agent 'message' strings containing any of these are treated as errors
+_ERROR_RE = re.compile(r'error|timeout|failed|cannot|exceed', re.IGNORECASE)
+# Event keys that may carry the query interpretation / SQL, in order of preference
+_INTERPRETATION_KEYS = ('interpretation', 'query_interpretation')
+_SQL_KEYS = ('sql', 'query', 'logical_query', 'physical_query', 'sql_query')
+_CONTENT_SQL_KEYS = ('sql', 'logical_query', 'query')
+# Words that make a channel message look like a question for Dex (substring match, any case)
+_QUESTION_RE = re.compile(
+    r'how many|what|show me|tell me|count|contracts|signed|operational|churn|channel',
+    re.IGNORECASE
+)
+
+# User mentions (<@U123ABC>) to strip from app_mention text
+_MENTION_RE = re.compile(r'<@[A-Z0-9]+>')
+
+# Openers that mark a section as a final answer vs. the agent talking to itself
+_ANSWER_PREFIXES = ('there', 'the', 'we have', 'a total', 'in total', '*')
+_REASONING_PREFIXES = ('i ', 'let ', 'the user', 'this seems')
+
+
+def filter_thinking_steps(text_parts):
+    """Remove agent's internal reasoning from a list of text parts and keep only the final answer"""
+    if not text_parts:
+        return None
+
+    # Strategy: Find the last substantial paragraph that doesn't contain thinking patterns
+    # Split each part by double newlines (paragraphs) rather than joining the parts first
+    paragraphs = [para for part in text_parts for para in part.split('\n\n')]
+
+    # Also split by single newlines for finer granularity
+    all_sections = []
+    for para in paragraphs:
+        all_sections.extend(para.split('\n'))
+
+    # Find the last substantial section that looks like a final answer
+    # Final answers typically:
+    # - Start with "There", "The", numbers, or direct statements
+    # - Are at least 30 characters
+    # - Don't contain thinking patterns
+    final_answer = None
+    for section in reversed(all_sections):
+        section_lower = section.lower().strip()
+        if not section_lower or len(section_lower) < 30:
+            continue
+
+        # Check if it contains thinking patterns
+        is_thinking = _THINKING_RE.search(section_lower) is not None
+        if is_thinking:
+            continue
+
+        # Check if it looks like a final answer
+        if (section_lower.startswith(_ANSWER_PREFIXES) or
+            section_lower[0].isdigit() or
+            (len(section_lower) > 50 and not section_lower.startswith(_REASONING_PREFIXES))):
+            final_answer = section.strip()
+            break
+
+    # If we found a final answer, return it
+    if final_answer:
+        return final_answer
+
+    # Fallback: return the last paragraph that's substantial and doesn't have thinking patterns
+    for para in reversed(paragraphs):
+        para_lower = para.lower().strip()
+        if para_lower and len(para_lower) > 30:
+            if not _THINKING_RE.search(para_lower):
+                return para.strip()
+
+    # Last resort: return original text
+    return '\n'.join(text_parts).strip()
+
+
+@dataclass(slots=True)
+class AgentResponse:
+    """Parsed Cortex Agent reply: the answer plus the query details behind "Show Query Details"."""
+    answer: str
+    interpretation: str | None = None
+    sql_query: str | None = None  # Primary SQL query (first one)
+    sql_queries: list = field(default_factory=list)  # All SQL queries (like the example)
+    verified: bool = False
+    metadata: dict | None = None  # Store metadata for debugging
+    step_count: int = 0  # Number of processing steps
+    planning_steps: list = field(default_factory=list)  # Planning steps (like the example)
+    thinking_steps: list = field(default_factory=list)  # Thinking steps (like the example)
+    processing_time: float | None = None  # Set by the caller once the agent call returns
+    answer_slack: str | None = None  # answer with **bold** converted to Slack *bold*, derived once
+    is_error: bool = False  # Agent-side failure reported as an answer (never cached)
+    
+    def __post_init__(self):
+        if self.answer_slack is None and self.answer:
+            self.answer_slack = self.answer.replace("**", "*")
+
+
+class AgentConcurrencyLimiter:
+    """
+    AIMD cap on concurrent Cortex Agent calls, so a slow or rate-limiting agent isn't piled on.
+    Every `window` calls the limit grows by 0.5 while mean latency stays under target and halves
+    otherwise; an overload response (429/502/503/timeout) halves it immediately.
+    """
+    
+    def __init__(self, initial=4, minimum=1, maximum=8, target_latency=30.0, window=20):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.window = window
+        self.limit = float(initial)
+        self._in_flight = 0
+        self._latencies = []
+        self._cond = threading.Condition()
+    
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+    
+    def release(self, latency, overloaded=False):
+        """Give the slot back; latency=None (e.g. a failed attempt being retried) records no sample"""
+        with self._cond:
+            self._in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit * 0.5)
+                self._latencies.clear()
+            elif latency is not None:
+                self._latencies.append(latency)
+                if len(self._latencies) >= self.window:
+                    mean_latency = sum(self._latencies) / len(self._latencies)
+                    if mean_latency < self.target_latency:
+                        self.limit = min(self.maximum, self.limit + 0.5)
+                    else:
+                        self.limit = max(self.minimum, self.limit * 0.5)
+                    self._latencies.clear()
+            self._cond.notify_all()
+
+
+# Same ceiling as _agent_executor; the limit only ever moves between 1 and that
+AGENT_LIMITER = AgentConcurrencyLimiter(maximum=8, target_latency=AGENT_LATENCY_TARGET)
+
+# Agent HTTP statuses that mean "back off" rather than "this request is wrong"
+_OVERLOAD_STATUS_CODES = (429, 502, 503)
+# Transient agent failures are retried (rate limits, gateway errors) before surfacing an error
+_RETRY_STATUS_CODES = (429, 502, 503, 504)
+AGENT_MAX_ATTEMPTS = 4
+AGENT_RETRY_MAX_DELAY = 30
+
+
+def agent_retry_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before retrying a failed agent call (attempt counts from 0).
+    Honors a numeric Retry-After header, otherwise exponential backoff with jitter.
+    """
+    if retry_after:
+        try:
+            return min(AGENT_RETRY_MAX_DELAY, float(retry_after))
+        except ValueError:
+            pass  # HTTP-date form; use the backoff instead
+    return min(AGENT_RETRY_MAX_DELAY, 2 ** attempt * random.uniform(0.5, 1.5))
+
+
 def call_cortex_agent(question):
     """
     Call Snowflake Cortex Agent REST API with a question.
     
-    Returns the agent's response as a formatted string.
+    Returns an AgentResponse, or an error string if the call itself failed.
     Based on Cortex Agent API response format.
     """
     if not AGENT_ENDPOINT or not PAT:
         return "❌ Error: AGENT_ENDPOINT or PAT not configured. Please check your .env file."
     
-    headers = {
-        "Authorization": f"Bearer {PAT}",
-        "Content-Type": "application/json"
-    }
-    
     # Cortex Agent API format: messages array with content as array of objects
     # For a new conversation, omit thread_id and parent_message_id
     payload = {
@@ -278,15 +537,41 @@ def call_cortex_agent(question):
         ]
     }
     
+    def wait_for_retry(delay, overloaded=False):
+        # Back off without holding a limiter slot; a throttled attempt shrinks the limit right away,
+        # and the clock restarts so the backoff isn't counted in the latency sample
+        nonlocal started
+        AGENT_LIMITER.release(None, overloaded)
+        time.sleep(delay)
+        AGENT_LIMITER.acquire()
+        started = time.monotonic()
+    
+    AGENT_LIMITER.acquire()
+    started = time.monotonic()
+    overloaded = False
     try:
-        # Cortex Agent API returns streaming Server-Sent Events (SSE)
-        response = requests.post(
-            AGENT_ENDPOINT,
-            headers=headers,
-            json=payload,
-            timeout=60,
-            stream=True  # Enable streaming for SSE
-        )
+        for attempt in range(AGENT_MAX_ATTEMPTS):
+            last_attempt = attempt == AGENT_MAX_ATTEMPTS - 1
+            try:
+                # Cortex Agent API returns streaming Server-Sent Events (SSE)
+                response = AGENT_SESSION.post(
+                    AGENT_ENDPOINT,
+                    json=payload,
+                    timeout=60,
+                    stream=True  # Enable streaming for SSE
+                )
+            except requests.exceptions.ConnectionError:
+                # Nothing reached the agent, so it is safe to send the question again
+                if last_attempt:
+                    raise
+                wait_for_retry(agent_retry_delay(attempt))
+                continue
+            if response.status_code not in _RETRY_STATUS_CODES or last_attempt:
+                break
+            delay = agent_retry_delay(attempt, response.headers.get("Retry-After"))
+            logger.warning(f"Cortex Agent returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+            wait_for_retry(delay, response.status_code in _OVERLOAD_STATUS_CODES)
         
         response.raise_for_status()
         
@@ -297,357 +582,231 @@ def call_cortex_agent(question):
         metadata = None
         interpretation = None
         sql_queries = []  # Track multiple SQL queries (like the example)
-        all_events = []
+        sql_seen = set()  # O(1) dedup for sql_queries (SQL strings can be multi-KB)
+        # Events are processed as they stream in and then dropped; only what the
+        # fallbacks below need is kept
+        event_count = 0
+        first_event = None  # For the debug log if nothing can be parsed
+        fallback_text = None  # Text of the first event that carries any
         step_count = 0  # Track number of processing steps
         planning_steps = []  # Track planning steps
         thinking_steps = []  # Track thinking steps
         error_message = None  # Track error messages from the agent
         
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    data_str = line_str[6:]  # Remove 'data: ' prefix
-                    try:
-                        event_data = json.loads(data_str)
-                        all_events.append(event_data)
-                        
-                        # Look for the final response event (last event)
-                        if event_data.get('role') == 'assistant':
-                            final_response = event_data
-                            # Check for metadata
-                            if 'metadata' in event_data:
-                                metadata = event_data['metadata']
-                            
-                            # DON'T collect text_content here - we'll extract from final_response at the end
-                            # This prevents capturing intermediate thinking steps from multiple assistant events
-                        
-                        # Look for interpretation in various places (not in metadata based on sample)
-                        if not interpretation:
-                            if 'interpretation' in event_data:
-                                interpretation = event_data.get('interpretation')
-                            elif 'query_interpretation' in event_data:
-                                interpretation = event_data.get('query_interpretation')
-                            elif 'message' in event_data and isinstance(event_data['message'], dict):
-                                if 'interpretation' in event_data['message']:
-                                    interpretation = event_data['message'].get('interpretation')
-                            # Check if interpretation is in content array
-                            elif 'content' in event_data:
-                                for item in event_data['content']:
-                                    if isinstance(item, dict) and 'interpretation' in item:
-                                        interpretation = item.get('interpretation')
-                                        break
-                        
-                        # Collect SQL queries (track multiple like the example)
-                        found_sql = None
-                        if 'sql' in event_data:
-                            found_sql = event_data.get('sql')
-                        elif 'query' in event_data and isinstance(event_data.get('query'), str):
-                            found_sql = event_data.get('query')
-                        elif 'logical_query' in event_data:
-                            found_sql = event_data.get('logical_query')
-                        elif 'physical_query' in event_data:
-                            found_sql = event_data.get('physical_query')
-                        elif 'sql_query' in event_data:
-                            found_sql = event_data.get('sql_query')
-                        # Check if SQL is in content array
-                        elif 'content' in event_data:
-                            for item in event_data['content']:
-                                if isinstance(item, dict):
-                                    if 'sql' in item:
-                                        found_sql = item.get('sql')
-                                        break
-                                    elif 'query' in item:
-                                        found_sql = item.get('query')
-                                        break
-                        
-                        # Add to SQL queries list if found and not already present
-                        if found_sql and found_sql not in sql_queries:
-                            sql_queries.append(found_sql)
-                        
-                        # Check for verified query information (metadata has is_semantic_sql which might indicate verification)
-                        if metadata and metadata.get('is_semantic_sql'):
-                            verified_query_info = True
-                        elif 'verified_query' in event_data or 'based_on_verified_query' in event_data:
-                            verified_query_info = event_data.get('verified_query') or event_data.get('based_on_verified_query')
-                        
-                        # Check for error messages
-                        if 'message' in event_data and isinstance(event_data.get('message'), str):
-                            msg = event_data.get('message', '')
-                            # Check if it's an error message (timeout, error, etc.)
-                            if any(keyword in msg.lower() for keyword in ['error', 'timeout', 'failed', 'cannot', 'exceed']):
-                                error_message = msg
-                                logger.warning(f"Agent returned error: {msg}")
-                        elif 'error' in event_data:
-                            error_message = str(event_data.get('error', ''))
-                            logger.warning(f"Agent returned error: {error_message}")
-                            
-                    except json.JSONDecodeError:
-                        continue
+        # Read in 8 KB chunks (default is 512 bytes) and keep lines as bytes
+        for line in response.iter_lines(chunk_size=8192, decode_unicode=False):
+            # Only 'data:' lines carry events; skip blank lines, ':' keep-alives and 'event:' lines.
+            # Work on the raw bytes; the payload is never needed as str
+            if not line.startswith(b'data: '):
+                continue
+            data_bytes = line[6:]  # Skip 'data: ' prefix
+            # Nothing to parse in an empty payload or the end-of-stream marker
+            if not data_bytes or data_bytes == b'[DONE]':
+                continue
+            try:
+                event_data = _loads(data_bytes)
+            except json.JSONDecodeError:
+                continue
+            event_count += 1
+            if first_event is None:
+                first_event = event_data
+            
+            # Remember the first event text in case no answer can be extracted below
+            if fallback_text is None:
+                if 'text' in event_data:
+                    fallback_text = event_data.get('text', '')
+                elif isinstance(event_data.get('content'), list):
+                    raw_text = next((item.get('text', '') for item in event_data['content']
+                                     if isinstance(item, dict) and item.get('type') == 'text'), None)
+                    if raw_text and raw_text.strip():
+                        fallback_text = raw_text
+            
+            # Look for the final response event (last event)
+            if event_data.get('role') == 'assistant':
+                final_response = event_data
+                # Check for metadata
+                if 'metadata' in event_data:
+                    metadata = event_data['metadata']
+                
+                # DON'T collect text_content here - we'll extract from final_response at the end
+                # This prevents capturing intermediate thinking steps from multiple assistant events
+            
+            # Look for interpretation in various places (not in metadata based on sample)
+            if not interpretation:
+                interpretation = next((event_data[k] for k in _INTERPRETATION_KEYS if k in event_data), None)
+                if interpretation is None and isinstance(event_data.get('message'), dict):
+                    interpretation = event_data['message'].get('interpretation')
+                # Check if interpretation is in content array (stop at the first hit)
+                if interpretation is None:
+                    interpretation = next((item[k] for item in event_data.get('content', ()) if isinstance(item, dict)
+                                           for k in _INTERPRETATION_KEYS if k in item), None)
+            
+            # Collect SQL queries (track multiple like the example)
+            found_sql = next((event_data[k] for k in _SQL_KEYS if isinstance(event_data.get(k), str)), None)
+            # Check if SQL is in content array (stop at the first hit)
+            if found_sql is None:
+                found_sql = next((item[k] for item in event_data.get('content', ()) if isinstance(item, dict)
+                                  for k in _CONTENT_SQL_KEYS if k in item), None)
+            
+            # Add to SQL queries list if found and not already present
+            if found_sql and found_sql not in sql_seen:
+                sql_seen.add(found_sql)
+                sql_queries.append(found_sql)
+            
+            # Check for verified query information (metadata has is_semantic_sql which might indicate verification)
+            if metadata and metadata.get('is_semantic_sql'):
+                verified_query_info = True
+            elif 'verified_query' in event_data or 'based_on_verified_query' in event_data:
+                verified_query_info = event_data.get('verified_query') or event_data.get('based_on_verified_query')
+            
+            # Check for error messages
+            if 'message' in event_data and isinstance(event_data.get('message'), str):
+                msg = event_data.get('message', '')
+                # Check if it's an error message (timeout, error, etc.)
+                if _ERROR_RE.search(msg):
+                    error_message = msg
+                    logger.warning(f"Agent returned error: {msg}")
+            elif 'error' in event_data:
+                error_message = str(event_data.get('error', ''))
+                logger.warning(f"Agent returned error: {error_message}")
         
         # If we got an error message, return it as the answer
         if error_message:
-            return {
-                'answer': f"⚠️ {error_message}\n\nPlease try a simpler question or contact the data analyst if the issue persists.",
-                'interpretation': None,
-                'sql_query': None,
-                'sql_queries': [],
-                'verified': False,
-                'metadata': metadata,
-                'step_count': 0,
-                'planning_steps': [],
-                'thinking_steps': []
-            }
+            return AgentResponse(
+                answer=f"⚠️ {error_message}\n\nPlease try a simpler question or contact the data analyst if the issue persists.",
+                metadata=metadata,
+                is_error=True
+            )
         
         # Extract answer, SQL, and interpretation from final response
         answer_text = None
         
         # PRIORITY 1: Extract from final_response first (this is the cleanest source)
-        # The final_response should contain only the final answer, not thinking steps
+        # The final_response should contain only the final answer, not thinking steps.
+        # A single pass over its content collects the answer text, SQL, interpretation and
+        # verified flag, plus the raw text used by PRIORITY 3 if no clean answer is found.
+        # Both buffers are local: handlers run on a thread pool, so they can't be shared
+        text_parts = []
+        fallback_parts = []
         if final_response:
             if 'content' in final_response and isinstance(final_response['content'], list):
-                text_parts = []
                 for item in final_response['content']:
+                    if not isinstance(item, dict):
+                        continue
+                    item_type = item.get('type')
+                    
                     # Extract text answers
-                    if isinstance(item, dict) and item.get('type') == 'text':
-                        text_value = item.get('text', '').strip()
+                    if item_type == 'text':
+                        raw_text = item.get('text', '')
+                        fallback_parts.append(raw_text)
+                        text_value = raw_text.strip()
                         if text_value:
                             text_parts.append(text_value)
                     
-                    # Also extract SQL from tool_result in final_response
-                    elif isinstance(item, dict) and item.get('type') == 'tool_result':
-                        tool_result = item.get('tool_result', {})
-                        if 'content' in tool_result and isinstance(tool_result['content'], list):
-                            for content_item in tool_result['content']:
-                                if isinstance(content_item, dict) and content_item.get('type') == 'json':
-                                    json_data = content_item.get('json', {})
-                                    if 'sql' in json_data:
-                                        found_sql = json_data.get('sql')
-                                        if found_sql and found_sql not in sql_queries:
-                                            sql_queries.append(found_sql)
-                                    # Also check verified status in final_response
-                                    if 'verified_query_used' in json_data:
-                                        if json_data.get('verified_query_used'):
-                                            verified_query_info = True
-                
-                if text_parts:
-                    answer_text = '\n'.join(text_parts)
-            
-            # Also check if final_response has text directly
-            elif 'text' in final_response:
-                answer_text = final_response.get('text', '').strip()
-        
-        # PRIORITY 2: Fall back to collected text_content (only if final_response didn't work)
-        # Helper function to filter out thinking/reasoning steps
-        def filter_thinking_steps(text):
-            """Remove agent's internal reasoning and keep only the final answer"""
-            if not text:
-                return text
-            
-            # Patterns that indicate thinking/reasoning (not final answer)
-            thinking_patterns = [
-                'the user is asking',
-                'let me query',
-                'i need to use',
-                'i have the sql results',
-                'wait, this seems',
-                'actually, looking at',
-                'let me check',
-                'this seems to be',
-                'this is quantitative',
-                'i need to',
-                'let me',
-                'this seems incorrect',
-                'looking at the',
-                'check if there',
-                'the results show',
-                'earliest termination',
-                'latest termination',
-                'spanning from'
-            ]
-            
-            # Strategy: Find the last substantial paragraph that doesn't contain thinking patterns
-            # Split by double newlines first (paragraphs)
-            paragraphs = text.split('\n\n')
-            
-            # Also split by single newlines for finer granularity
-            all_sections = []
-            for para in paragraphs:
-                all_sections.extend(para.split('\n'))
-            
-            # Find the last substantial section that looks like a final answer
-            # Final answers typically:
-            # - Start with "There", "The", numbers, or direct statements
-            # - Are at least 30 characters
-            # - Don't contain thinking patterns
-            final_answer = None
-            for section in reversed(all_sections):
-                section_lower = section.lower().strip()
-                if not section_lower or len(section_lower) < 30:
-                    continue
-                
-                # Check if it contains thinking patterns
-                is_thinking = any(pattern in section_lower for pattern in thinking_patterns)
-                if is_thinking:
-                    continue
-                
-                # Check if it looks like a final answer
-                if (section_lower.startswith(('there', 'the', 'we have', 'a total', 'in total', '*')) or
-                    section_lower[0].isdigit() or
-                    (len(section_lower) > 50 and not section_lower.startswith(('i ', 'let ', 'the user', 'this seems')))):
-                    final_answer = section.strip()
-                    break
-            
-            # If we found a final answer, return it
-            if final_answer:
-                return final_answer
-            
-            # Fallback: return the last paragraph that's substantial and doesn't have thinking patterns
-            for para in reversed(paragraphs):
-                para_lower = para.lower().strip()
-                if para_lower and len(para_lower) > 30:
-                    if not any(pattern in para_lower for pattern in thinking_patterns):
-                        return para.strip()
-            
-            # Last resort: return original text
-            return text.strip()
-        
-        # PRIORITY 2: Fall back to collected text_content (only if final_response didn't work)
-        # This collects text from events as they stream in
-        if not answer_text and text_content:
-            # Join all text content, filtering out empty strings
-            filtered_text = [t for t in text_content if t and t.strip()]
-            if filtered_text:
-                full_text = '\n'.join(filtered_text)
-                # Filter out thinking steps
-                answer_text = filter_thinking_steps(full_text)
-            elif text_content:
-                full_text = ''.join(text_content)
-                answer_text = filter_thinking_steps(full_text)
-        
-        # PRIORITY 3: Try to extract from final_response content array (if both above didn't work)
-        if not answer_text and final_response:
-            # Check if content is a list
-            if 'content' in final_response and isinstance(final_response['content'], list):
-                text_parts = []
-                for item in final_response['content']:
-                    # Extract text answers
-                    if isinstance(item, dict) and item.get('type') == 'text':
-                        text_parts.append(item.get('text', ''))
-                    
-                    # Check for image/chart content (if Cortex Agent returns charts)
-                    elif isinstance(item, dict) and item.get('type') == 'image':
-                        # If Cortex Agent returns image data, we'd handle it here
-                        # For now, this is a placeholder - Cortex Agent typically describes charts in text
-                        pass
-                    
                     # Extract SQL and interpretation from tool_result
-                    elif isinstance(item, dict) and item.get('type') == 'tool_result':
+                    elif item_type == 'tool_result':
                         tool_result = item.get('tool_result', {})
                         tool_name = tool_result.get('name', '')
                         
                         if 'content' in tool_result and isinstance(tool_result['content'], list):
                             for content_item in tool_result['content']:
-                                if isinstance(content_item, dict):
-                                    # Handle JSON content
-                                    if content_item.get('type') == 'json' and 'json' in content_item:
-                                        json_data = content_item['json']
-                                        
-                                        # Extract SQL query (prefer from contract_analytics)
-                                        if 'sql' in json_data:
-                                            found_sql = json_data.get('sql')
-                                            if found_sql and found_sql not in sql_queries:
-                                                sql_queries.append(found_sql)
-                                        
-                                        # Extract interpretation (use 'text' field as interpretation)
-                                        # Always extract from contract_analytics, or use first available
-                                        if 'text' in json_data:
-                                            text_value = json_data.get('text', '').strip()
-                                            if text_value:  # Only use non-empty text
-                                                # Always prefer contract_analytics, otherwise use first available
-                                                if tool_name == 'contract_analytics':
-                                                    interpretation = text_value
-                                                elif not interpretation:  # Use first available if we don't have one yet
-                                                    interpretation = text_value
-                                        
-                                        # Extract verified status
-                                        if 'verified_query_used' in json_data:
-                                            if json_data.get('verified_query_used'):
-                                                verified_query_info = True
+                                if not isinstance(content_item, dict):
+                                    continue
+                                content_type = content_item.get('type')
+                                
+                                # Handle JSON content
+                                if content_type == 'json' and 'json' in content_item:
+                                    json_data = content_item['json']
+                                    
+                                    # Extract SQL query
+                                    if 'sql' in json_data:
+                                        found_sql = json_data.get('sql')
+                                        if found_sql and found_sql not in sql_seen:
+                                            sql_seen.add(found_sql)
+                                            sql_queries.append(found_sql)
                                     
-                                    # Handle text content in tool_result
-                                    elif content_item.get('type') == 'text':
-                                        text_value = content_item.get('text', '').strip()
-                                        if text_value:
-                                            text_parts.append(text_value)
+                                    # Extract interpretation (use 'text' field as interpretation)
+                                    # Always prefer contract_analytics, otherwise use first available
+                                    if 'text' in json_data:
+                                        text_value = json_data.get('text', '').strip()
+                                        if text_value and (tool_name == 'contract_analytics' or not interpretation):
+                                            interpretation = text_value
+                                    
+                                    # Extract verified status
+                                    if json_data.get('verified_query_used'):
+                                        verified_query_info = True
+                                
+                                # Handle text content in tool_result
+                                elif content_type == 'text':
+                                    text_value = content_item.get('text', '').strip()
+                                    if text_value:
+                                        fallback_parts.append(text_value)
                     
                     # Also check tool_use for verified query reference (can provide better context)
-                    elif isinstance(item, dict) and item.get('type') == 'tool_use':
+                    elif item_type == 'tool_use':
                         tool_use = item.get('tool_use', {})
                         if tool_use.get('name') == 'contract_analytics' and 'input' in tool_use:
                             input_data = tool_use.get('input', {})
-                            # Check if there's a verified query reference that might have better interpretation
+                            # Use the verified query question as interpretation context
                             if 'reference_vqrs' in input_data and isinstance(input_data['reference_vqrs'], list):
                                 if input_data['reference_vqrs'] and not interpretation:
-                                    # Use the verified query question as interpretation context
                                     vqr = input_data['reference_vqrs'][0]
                                     if 'question' in vqr:
                                         interpretation = f"Using verified query: {vqr['question']}"
-            
-                if text_parts:
-                    full_text = '\n'.join(text_parts)
-                    answer_text = filter_thinking_steps(full_text)
+                
+                if len(text_parts) == 1:
+                    answer_text = text_parts[0]  # Common case: a single text block, no join needed
+                elif text_parts:
+                    answer_text = '\n'.join(text_parts)
             
             # Also check if final_response has text directly
             elif 'text' in final_response:
-                raw_text = final_response.get('text', '')
-                answer_text = filter_thinking_steps(raw_text)
+                answer_text = final_response.get('text', '').strip()
         
-        # Final fallback: check if we have any text in the response at all (if both above failed)
-        if not answer_text:
-            # Try to extract from any event that has text
-            for event in all_events:
-                if 'text' in event:
-                    raw_text = event.get('text', '')
-                    answer_text = filter_thinking_steps(raw_text)
-                    break
-                elif 'content' in event:
-                    # Check content array for text
-                    if isinstance(event['content'], list):
-                        for item in event['content']:
-                            if isinstance(item, dict) and item.get('type') == 'text':
-                                raw_text = item.get('text', '')
-                                answer_text = filter_thinking_steps(raw_text)
-                                break
-                        if answer_text:
-                            break
+        # PRIORITY 2: Fall back to collected text_content (only if final_response didn't work)
+        # This collects text from events as they stream in
+        if not answer_text and text_content:
+            # Filter out empty strings, then thinking steps
+            filtered_text = [t for t in text_content if t and t.strip()]
+            if filtered_text:
+                answer_text = filter_thinking_steps(filtered_text)
+        
+        # PRIORITY 3: Filter thinking steps out of everything final_response said (if both above didn't work)
+        if not answer_text and fallback_parts:
+            answer_text = filter_thinking_steps(fallback_parts)
+        
+        # Final fallback: use the first event text seen while streaming (if both above failed)
+        if not answer_text and fallback_text is not None:
+            answer_text = filter_thinking_steps([fallback_text])
         
         # If still no answer, log for debugging and return error
         if not answer_text:
-            logger.warning(f"Could not parse answer from agent response. Events: {len(all_events)}, text_content items: {len(text_content)}")
+            logger.warning(f"Could not parse answer from agent response. Events: {event_count}, text_content items: {len(text_content)}")
             # Log first event structure for debugging (but don't log full SQL which could be huge)
-            if all_events:
-                sample_event = all_events[0]
+            if first_event is not None:
+                sample_event = first_event
                 if isinstance(sample_event, dict):
                     # Log structure without full content - show keys and types
-                    event_summary = {}
-                    for k, v in sample_event.items():
-                        if k in ['text', 'message', 'answer']:
-                            # Show preview of text fields
-                            if isinstance(v, str):
-                                preview = v[:200] + "..." if len(v) > 200 else v
-                                event_summary[k] = f"'{preview}'"
+                    # (only built when the warning will actually be emitted)
+                    if logger.isEnabledFor(logging.WARNING):
+                        event_summary = {}
+                        for k, v in sample_event.items():
+                            if k in ['text', 'message', 'answer']:
+                                # Show preview of text fields
+                                if isinstance(v, str):
+                                    preview = v[:200] + "..." if len(v) > 200 else v
+                                    event_summary[k] = f"'{preview}'"
+                                else:
+                                    event_summary[k] = str(type(v).__name__)
+                            elif k == 'content':
+                                if isinstance(v, list):
+                                    content_types = [type(item).__name__ if not isinstance(item, dict) else item.get('type', 'dict') for item in v[:3]]
+                                    event_summary[k] = f"list[{len(v)}] with types: {content_types}"
+                                else:
+                                    event_summary[k] = str(type(v).__name__)
                             else:
                                 event_summary[k] = str(type(v).__name__)
-                        elif k == 'content':
-                            if isinstance(v, list):
-                                content_types = [type(item).__name__ if not isinstance(item, dict) else item.get('type', 'dict') for item in v[:3]]
-                                event_summary[k] = f"list[{len(v)}] with types: {content_types}"
-                            else:
-                                event_summary[k] = str(type(v).__name__)
-                        else:
-                            event_summary[k] = str(type(v).__name__)
-                    logger.warning(f"Sample event structure: {event_summary}")
+                        logger.warning(f"Sample event structure: {event_summary}")
                     
                     # Try one more aggressive extraction from the sample event
                     if 'content' in sample_event:
@@ -656,12 +815,12 @@ def call_cortex_agent(question):
                             for item in content:
                                 if isinstance(item, dict):
                                     # Try any field that might contain text
-                                    for field in ['text', 'message', 'answer', 'response', 'output']:
-                                        if field in item:
-                                            potential_text = item[field]
+                                    for key in ['text', 'message', 'answer', 'response', 'output']:
+                                        if key in item:
+                                            potential_text = item[key]
                                             if isinstance(potential_text, str) and potential_text.strip():
                                                 answer_text = potential_text
-                                                logger.info(f"Found answer in content[{field}] via fallback")
+                                                logger.info(f"Found answer in content[{key}] via fallback")
                                                 break
                                     if answer_text:
                                         break
@@ -670,71 +829,10 @@ def call_cortex_agent(question):
             
             # If we still don't have an answer after aggressive parsing, return error
             if not answer_text:
-                return {
-                    'answer': "✅ Received response from agent, but couldn't parse the format. The agent is working! Please try rephrasing your question.",
-                    'interpretation': None,
-                    'sql_query': None,
-                    'sql_queries': [],
-                    'verified': False,
-                    'metadata': None,
-                    'step_count': 0,
-                    'planning_steps': [],
-                    'thinking_steps': []
-                }
-        
-        # Final check: Look through all events for interpretation if we didn't find it yet
-        # Also check content arrays recursively
-        if not interpretation:
-            for event in all_events:
-                # Direct fields
-                if 'interpretation' in event:
-                    interpretation = event.get('interpretation')
-                    break
-                elif 'query_interpretation' in event:
-                    interpretation = event.get('query_interpretation')
-                    break
-                # Check content arrays
-                elif 'content' in event:
-                    for item in event['content']:
-                        if isinstance(item, dict):
-                            if 'interpretation' in item:
-                                interpretation = item.get('interpretation')
-                                break
-                            elif 'query_interpretation' in item:
-                                interpretation = item.get('query_interpretation')
-                                break
-                    if interpretation:
-                        break
-        
-        # Final check: Look through all events for SQL queries if we haven't found any yet
-        # Also check content arrays recursively
-        if not sql_queries:
-            for event in all_events:
-                found_sql = None
-                # Direct fields
-                if 'sql' in event:
-                    found_sql = event.get('sql')
-                elif 'logical_query' in event:
-                    found_sql = event.get('logical_query')
-                elif 'sql_query' in event:
-                    found_sql = event.get('sql_query')
-                # Check content arrays
-                elif 'content' in event:
-                    for item in event['content']:
-                        if isinstance(item, dict):
-                            if 'sql' in item:
-                                found_sql = item.get('sql')
-                                break
-                            elif 'logical_query' in item:
-                                found_sql = item.get('logical_query')
-                                break
-                            elif 'query' in item:
-                                found_sql = item.get('query')
-                                break
-                
-                if found_sql and found_sql not in sql_queries:
-                    sql_queries.append(found_sql)
-                    break
+                return AgentResponse(
+                    answer="✅ Received response from agent, but couldn't parse the format. The agent is working! Please try rephrasing your question.",
+                    is_error=True
+                )
         
         # Build response with answer and optional query details
         # Store query details separately for the "show more" button
@@ -764,23 +862,23 @@ def call_cortex_agent(question):
         if sql_queries and not is_verified:
             is_verified = True  # If we have SQL queries, it's likely from a verified semantic view
         
-        response_data = {
-            'answer': answer_text,
-            'interpretation': interpretation,
-            'sql_query': sql_query,  # Primary SQL query (first one)
-            'sql_queries': sql_queries,  # All SQL queries (like the example)
-            'verified': is_verified or bool(verified_query_info),
-            'metadata': metadata,  # Store metadata for debugging
-            'step_count': step_count,  # Number of processing steps
-            'planning_steps': planning_steps,  # Planning steps (like the example)
-            'thinking_steps': thinking_steps  # Thinking steps (like the example)
-        }
-        
-        return response_data
+        return AgentResponse(
+            answer=answer_text,
+            interpretation=interpretation,
+            sql_query=sql_query,
+            sql_queries=sql_queries,
+            verified=is_verified or bool(verified_query_info),
+            metadata=metadata,
+            step_count=step_count,
+            planning_steps=planning_steps,
+            thinking_steps=thinking_steps
+        )
             
     except requests.exceptions.Timeout:
+        overloaded = True
         return "⏱️ Request timed out. The query may be taking too long. Try a simpler question."
     except requests.exceptions.HTTPError as e:
+        overloaded = e.response.status_code in _OVERLOAD_STATUS_CODES
         if e.response.status_code == 401:
             return "❌ Authentication failed. Please check your PAT (Programmatic Access Token)."
         elif e.response.status_code == 404:
@@ -790,6 +888,100 @@ def call_cortex_agent(question):
             return f"❌ Error {e.response.status_code}: {error_text}"
     except Exception as e:
         return f"❌ Error calling Cortex Agent: {str(e)}"
+    finally:
+        AGENT_LIMITER.release(time.monotonic() - started, overloaded)
+
+
+# Recent successful answers keyed by normalized question text (quick-start buttons repeat a lot);
+# maps key -> (AgentResponse, cached at), oldest first, same expiry scheme as _command_state
+_agent_cache = OrderedDict()
+_AGENT_CACHE_MAX = 256
+_AGENT_CACHE_TTL = 60
+_agent_cache_lock = threading.Lock()
+
+
+def ask_cortex_agent(question):
+    """
+    call_cortex_agent with a short-lived cache of successful answers (errors are not cached).
+    Returns a fresh AgentResponse copy each time, since callers stamp processing_time on it.
+    """
+    # Interned so repeat questions hit the cache with an identity compare
+    key = sys.intern(" ".join(question.lower().split()))
+    now = time.monotonic()
+    with _agent_cache_lock:
+        # Keys are in insertion order, so expired entries are all at the front
+        while _agent_cache:
+            _, cached_at = next(iter(_agent_cache.values()))
+            if now - cached_at < _AGENT_CACHE_TTL:
+                break
+            _agent_cache.popitem(last=False)
+        entry = _agent_cache.get(key)
+    if entry:
+        logger.info(f"Answering from cache: {key[:80]}")
+        return replace(entry[0])
+    
+    response_data = call_cortex_agent(question)
+    # Errors (strings or agent-side failures) are never cached, so a transient failure doesn't stick
+    if isinstance(response_data, AgentResponse) and not response_data.is_error:
+        with _agent_cache_lock:
+            # Stamp after the call returns (it can take 20-30s) and keep the dict in time order,
+            # so the TTL is measured from when the answer arrived and expired entries stay at the front
+            _agent_cache[key] = (response_data, time.monotonic())
+            _agent_cache.move_to_end(key)
+            while len(_agent_cache) > _AGENT_CACHE_MAX:
+                _agent_cache.popitem(last=False)
+        return replace(response_data)
+    return response_data
+
+
+# Static blocks shared by every render (Slack only serializes them - never mutate)
+DIVIDER_BLOCK = {"type": "divider"}
+SQL_CONTEXT_BLOCK = {
+    "type": "context",
+    "elements": [
+        {
+            "type": "mrkdwn",
+            "text": "ℹ️ All SQL queries were already executed by Cortex during analysis. Results are included in the response above."
+        }
+    ]
+}
+PROCESSING_BLOCK = {
+    "type": "section",
+    "text": {
+        "type": "mrkdwn",
+        "text": ":snowflake: *Snowflake Cortex Agent* is processing your request...",
+    }
+}
+
+
+def processing_blocks(question):
+    """Blocks for the "processing" placeholder: only the question section is built per request"""
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Your question:* {question}"
+            }
+        },
+        DIVIDER_BLOCK,
+        PROCESSING_BLOCK,
+        DIVIDER_BLOCK,
+    ]
+
+
+def sql_query_label(count):
+    """Return "1 SQL query" / "N SQL queries" for the summary lines"""
+    return "1 SQL query" if count == 1 else f"{count} SQL queries"
+
+
+# Serialized size of the button payload's keys and scalar values (verified, step_count,
+# processing_time, action) with empty text fields; measured once from json.dumps (orjson is more compact)
+_BUTTON_VALUE_OVERHEAD = 200
+
+# Slack only shows the first ~100 chars of the text fallback in notifications;
+# the full answer is already in the blocks
+TEXT_FALLBACK_MAX = 150
 
 
 def truncate_button_value(data):
@@ -800,7 +992,9 @@ def truncate_button_value(data):
     max_length = 2000  # Leave 1 char buffer
     
     # Extract and truncate fields
-    answer = data.get("answer", "")[:300] if data.get("answer") else ""
+    # The answer is stored already converted for Slack so re-renders don't convert it again
+    answer = data.get("answer_slack") or (data.get("answer") or "").replace("**", "*")
+    answer = answer[:300]
     sql_query = data.get("sql_query", "")
     sql_queries = data.get("sql_queries", [])
     interpretation = data.get("interpretation", "")[:200] if data.get("interpretation") else ""
@@ -808,7 +1002,7 @@ def truncate_button_value(data):
     
     # Build minimal payload first
     minimal_data = {
-        "answer": answer,
+        "answer_slack": answer,
         "sql_query": None,
         "sql_queries": [],
         "interpretation": interpretation,
@@ -819,37 +1013,41 @@ def truncate_button_value(data):
         "action": data.get("action", "show")
     }
     
-    # Calculate available space for SQL
-    base_json = json.dumps(minimal_data)
-    available_space = max_length - len(base_json) - 100  # Buffer for SQL array formatting
-    
-    # Truncate SQL queries to fit
-    if sql_queries:
-        max_sql_per_query = max(200, available_space // max(1, len(sql_queries)))
-        truncated_queries = []
-        for q in sql_queries:
-            if q and len(q) > max_sql_per_query:
-                truncated_queries.append(q[:max_sql_per_query] + "...")
-            else:
-                truncated_queries.append(q)
-        minimal_data["sql_queries"] = truncated_queries
-        minimal_data["sql_query"] = truncated_queries[0] if truncated_queries else None
-    elif sql_query:
-        max_sql_length = max(200, available_space)
-        if len(sql_query) > max_sql_length:
-            minimal_data["sql_query"] = sql_query[:max_sql_length] + "..."
-            minimal_data["sql_queries"] = [minimal_data["sql_query"]]
+    # Calculate available space for SQL from the field lengths (no probe serialization);
+    # non-ASCII is written as-is by _dumps so the character counts hold for Swedish text too
+    base_length = _BUTTON_VALUE_OVERHEAD
+    for text in (answer, interpretation, question):
+        # Newlines and quotes each gain a backslash when serialized
+        base_length += len(text) + text.count("\n") + text.count('"')
+    available_space = max_length - base_length - 100  # Buffer for SQL array formatting and escapes
+    
+    # Use sql_queries if available, otherwise fall back to sql_query
+    queries = sql_queries if sql_queries else ([sql_query] if sql_query else [])
+    if queries:
+        # Serialized SQL size: every query plus the first one again as sql_query,
+        # with a backslash for each newline
+        sql_size = sum(len(q) + q.count("\n") for q in queries if q)
+        sql_size += len(queries[0] or "") + (queries[0] or "").count("\n")
+        if sql_size <= available_space:
+            # Fast path: everything already fits, keep the SQL as-is
+            minimal_data["sql_queries"] = queries
         else:
-            minimal_data["sql_query"] = sql_query
-            minimal_data["sql_queries"] = [sql_query]
+            # Truncate SQL queries to fit
+            # +1 because the first query is stored twice (sql_queries[0] and sql_query)
+            max_sql_per_query = max(200, available_space // (len(queries) + 1))
+            minimal_data["sql_queries"] = [
+                q[:max_sql_per_query] + "..." if q and len(q) > max_sql_per_query else q
+                for q in queries
+            ]
+        minimal_data["sql_query"] = minimal_data["sql_queries"][0]
     
     # Final check and return
-    result = json.dumps(minimal_data)
+    result = _dumps(minimal_data)
     if len(result) > max_length:
         # Emergency truncation - remove SQL entirely if still too long
         minimal_data["sql_query"] = None
         minimal_data["sql_queries"] = []
-        result = json.dumps(minimal_data)
+        result = _dumps(minimal_data)
     
     return result
 
@@ -859,7 +1057,7 @@ def format_slack_response(response_data, question=""):
     Format agent response data into Slack Block Kit format with interpretation visible and optional "Show Query Details" button.
     
     Args:
-        response_data: Dict with 'answer', 'interpretation', 'sql_query', 'verified' keys
+        response_data: AgentResponse from call_cortex_agent
                       OR a string (fallback)
         question: The user's original question (optional, for display)
     
@@ -870,17 +1068,15 @@ def format_slack_response(response_data, question=""):
     if isinstance(response_data, str):
         return None, response_data
     
-    answer = response_data.get('answer', 'No answer received')
-    sql_query = response_data.get('sql_query')
-    sql_queries = response_data.get('sql_queries', [])
-    # If sql_queries is empty but sql_query exists, use it
-    if not sql_queries and sql_query:
-        sql_queries = [sql_query]
-    interpretation = response_data.get('interpretation')
-    verified = response_data.get('verified', False)
-    step_count = response_data.get('step_count', 0)
-    planning_steps = response_data.get('planning_steps', [])
-    thinking_steps = response_data.get('thinking_steps', [])
+    answer = response_data.answer or 'No answer received'
+    sql_query = response_data.sql_query
+    # If sql_queries is empty but sql_query exists, use it (computed once, reused below)
+    queries = response_data.sql_queries or ([sql_query] if sql_query else [])
+    interpretation = response_data.interpretation
+    verified = response_data.verified
+    step_count = response_data.step_count
+    planning_steps = response_data.planning_steps
+    thinking_steps = response_data.thinking_steps
     
     # Build blocks for Slack message
     blocks = []
@@ -894,25 +1090,22 @@ def format_slack_response(response_data, question=""):
                 "text": f"*Your question:* {question}"
             }
         })
-        blocks.append({"type": "divider"})
+        blocks.append(DIVIDER_BLOCK)
     
     # Add "Completed!" section BEFORE the answer (simpler - just show completion status)
     # Build additional info
     additional_info = []
     if verified:
-        additional_info.append(f"{VERIFIED_EMOJI} answer accuracy verified by agent owner")
-    # Check both sql_queries and sql_query to ensure we show the count
-    queries_to_count = sql_queries if sql_queries else ([sql_query] if sql_query else [])
-    if queries_to_count:
-        query_count = len(queries_to_count)
-        additional_info.append(f"{query_count} SQL {'query' if query_count == 1 else 'queries'}")
+        additional_info.append(VERIFIED_LABEL)
+    if queries:
+        additional_info.append(sql_query_label(len(queries)))
     # If we have verified status but no SQL queries listed, still show "1 SQL query" 
     # (the agent used a query even if we couldn't extract it)
-    elif verified and not queries_to_count:
+    elif verified:
         additional_info.append("1 SQL query")
     
     # Build summary text with step count
-    processing_time = response_data.get('processing_time')
+    processing_time = response_data.processing_time
     if step_count > 0:
         summary_text = f"_Finished {step_count} steps"
     else:
@@ -936,11 +1129,11 @@ def format_slack_response(response_data, question=""):
         }
     })
     
-    blocks.append({"type": "divider"})  # Add divider before answer
+    blocks.append(DIVIDER_BLOCK)  # Add divider before answer
     
     # Then show the answer
     # Convert markdown format if needed (Slack uses *bold* not **bold**)
-    answer_formatted = answer.replace("**", "*")  # Convert **bold** to *bold* for Slack
+    answer_formatted = response_data.answer_slack or answer.replace("**", "*")  # *bold* for Slack
     blocks.append({
         "type": "section",
         "text": {
@@ -951,16 +1144,15 @@ def format_slack_response(response_data, question=""):
     
     # Add "Show Details" button if SQL query/queries or interpretation is available
     # Always show button if we have SQL queries (even if empty, the agent might have used a query)
-    has_sql = bool(sql_queries) or bool(sql_query)
-    if has_sql or interpretation:
+    if queries or interpretation:
         button_data = {
-            "answer": answer,
+            "answer_slack": answer_formatted,
             "sql_query": sql_query,
-            "sql_queries": sql_queries if sql_queries else ([sql_query] if sql_query else []),
+            "sql_queries": queries,
             "interpretation": interpretation,
             "verified": verified,
             "step_count": step_count,
-            "processing_time": response_data.get('processing_time'),
+            "processing_time": processing_time,
             "question": question,  # Store question for details view
             "action": "show"
         }
@@ -981,10 +1173,10 @@ def format_slack_response(response_data, question=""):
             ]
         })
     
-    # Build text fallback (for notifications)
+    # Build text fallback (for notifications) - truncated, the blocks carry the full answer
     text_fallback = answer
-    if interpretation:
-        text_fallback = f"Interpretation: {interpretation}\n\n{answer}"
+    if len(answer) > TEXT_FALLBACK_MAX:
+        text_fallback = answer[:TEXT_FALLBACK_MAX - 1] + "…"
     
     return blocks, text_fallback
 
@@ -993,12 +1185,58 @@ def format_slack_response(response_data, question=""):
 def handle_dex_help(ack, respond):
     """Handle /dex-help command to show help message"""
     ack()
-    welcome_msg = get_welcome_message()
-    respond(blocks=welcome_msg["blocks"], text="Dex Help - Contract Analytics Assistant")
+    respond(blocks=WELCOME_BLOCKS, text=HELP_TEXT)
+
+
+def answer_in_background(client, question, channel_id, placeholder_ts, start_time, thread_ts=None):
+    """
+    Run the Cortex Agent call for a question and replace the placeholder message with the answer.
+    Executed on _agent_executor; any error is written into the placeholder instead of raised.
+    """
+    try:
+        # Call Cortex Agent
+        response_data = ask_cortex_agent(question)
+        
+        # Calculate total processing time BEFORE formatting (so it can be displayed)
+        elapsed_time = time.time() - start_time
+        if isinstance(response_data, AgentResponse):
+            response_data.processing_time = elapsed_time
+        
+        # Format response with optional "Show Query Details" button (include question for display)
+        blocks, text_fallback = format_slack_response(
+            response_data, 
+            question=question
+        )
+    except Exception as e:
+        logger.error(f"Error answering question in background: {str(e)}", exc_info=True)
+        blocks = None
+        text_fallback = f"❌ Error processing question: {str(e)}\n\nPlease try again or use `/dex [your question]`"
+    
+    # Update the processing message with the final response
+    try:
+        if placeholder_ts:
+            client.chat_update(
+                channel=channel_id,
+                ts=placeholder_ts,
+                text=text_fallback,
+                blocks=blocks if blocks else None
+            )
+            return
+    except Exception as update_error:
+        logger.error(f"Could not update message: {update_error}", exc_info=True)
+    
+    # Fallback: send as new message if update not possible
+    try:
+        if blocks:
+            client.chat_postMessage(channel=channel_id, blocks=blocks, text=text_fallback, thread_ts=thread_ts)
+        else:
+            client.chat_postMessage(channel=channel_id, text=text_fallback, thread_ts=thread_ts)
+    except SlackApiError as e:
+        logger.error(f"Error posting response: {str(e)}")
 
 
 @app.message("")
-def handle_message(message, say):
+def handle_message(message, say, client):
     """
     Handle all messages in channels where the bot is present.
     Only responds to messages that look like questions about contracts.
@@ -1026,49 +1264,31 @@ def handle_message(message, say):
         return
     
     # Check if it's a question (ends with ? or contains question words)
-    is_question = (
-        text.endswith("?") or
-        any(word in text.lower() for word in [
-            "how many", "what", "show me", "tell me", "count", 
-            "contracts", "signed", "operational", "churn", "channel"
-        ])
-    )
+    is_question = text.endswith("?") or _QUESTION_RE.search(text) is not None
     
     if not is_question:
         return
     
-    # Show typing indicator
-    try:
-        app.client.conversations_mark(
-            channel=message["channel"],
-            ts=message["ts"]
-        )
-    except:
-        pass
-    
-    # Call Cortex Agent
+    # Post a placeholder in the thread and answer from the background pool
     start_time = time.time()
-    response_data = call_cortex_agent(text)
-    elapsed_time = time.time() - start_time
-    
-    # Add processing time to response
-    if isinstance(response_data, dict):
-        response_data['processing_time'] = elapsed_time
-    
-    # Format response with optional "Show Query Details" button (include question for display)
-    blocks, text_fallback = format_slack_response(
-        response_data, 
-        question=text
-    )
-    
-    # Post response in thread
     try:
-        if blocks:
-            say(blocks=blocks, text=text_fallback, thread_ts=message.get("ts"))
-        else:
-            say(text_fallback, thread_ts=message.get("ts"))
+        placeholder = say(
+            text=":snowflake: *Snowflake Cortex Agent* is processing your request...",
+            thread_ts=message.get("ts")
+        )
     except SlackApiError as e:
-        say(f"❌ Error posting response: {str(e)}", thread_ts=message.get("ts"))
+        logger.error(f"Error posting processing message: {str(e)}")
+        placeholder = None
+    
+    _agent_executor.submit(
+        answer_in_background,
+        client,
+        text,
+        message["channel"],
+        placeholder.get("ts") if placeholder else None,
+        start_time,
+        thread_ts=message.get("ts")
+    )
 
 
 @app.action(re.compile("^quick_question"))
@@ -1101,67 +1321,18 @@ def handle_quick_question(ack, body, respond, client):
         initial_message = client.chat_postMessage(
             channel=channel_id,
             text=f"Your question: {question}\n\nProcessing...",
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Your question:* {question}"
-                    }
-                },
-                {
-                    "type": "divider"
-                },
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": ":snowflake: *Snowflake Cortex Agent* is processing your request...",
-                    }
-                },
-                {
-                    "type": "divider"
-                },
-            ]
+            blocks=processing_blocks(question)
         )
-        initial_response = {"ts": initial_message.get("ts"), "channel": initial_message.get("channel")} if initial_message else None
-        
-        # Call Cortex Agent
-        response_data = call_cortex_agent(question)
-        
-        # Calculate total processing time BEFORE formatting (so it can be displayed)
-        elapsed_time = time.time() - start_time
-        if isinstance(response_data, dict):
-            response_data['processing_time'] = elapsed_time
         
-        # Format response
-        blocks, text_fallback = format_slack_response(
-            response_data, 
-            question=question
+        # Answer from the background pool so this action handler returns immediately
+        _agent_executor.submit(
+            answer_in_background,
+            client,
+            question,
+            initial_message.get("channel", channel_id) if initial_message else channel_id,
+            initial_message.get("ts") if initial_message else None,
+            start_time
         )
-        
-        # Update the initial processing message with the final response
-        try:
-            if initial_response and 'ts' in initial_response:
-                client.chat_update(
-                    channel=initial_response.get('channel', channel_id),
-                    ts=initial_response['ts'],
-                    text=text_fallback,
-                    blocks=blocks if blocks else None
-                )
-            else:
-                # Fallback: send new message if update not possible
-                if blocks:
-                    client.chat_postMessage(channel=channel_id, blocks=blocks, text=text_fallback)
-                else:
-                    client.chat_postMessage(channel=channel_id, text=text_fallback)
-        except Exception as update_error:
-            logger.error(f"Could not update message: {update_error}", exc_info=True)
-            # Fallback: send as new message
-            if blocks:
-                client.chat_postMessage(channel=channel_id, blocks=blocks, text=text_fallback)
-            else:
-                client.chat_postMessage(channel=channel_id, text=text_fallback)
                 
     except Exception as e:
         logger.error(f"Error handling quick question: {str(e)}", exc_info=True)
@@ -1171,6 +1342,60 @@ def handle_quick_question(ack, body, respond, client):
         )
 
 
+def build_header_and_answer_blocks(question, answer_slack, verified, step_count, processing_time, queries_to_count):
+    """
+    Build the question header, "Completed!" summary and answer blocks shared by the show/hide views.
+    answer_slack is the answer already converted to Slack markdown.
+    """
+    additional_info = []
+    if verified:
+        additional_info.append(VERIFIED_LABEL)
+    if queries_to_count:
+        additional_info.append(sql_query_label(len(queries_to_count)))
+    
+    if step_count > 0:
+        summary_text = f"_Finished {step_count} steps"
+    else:
+        summary_text = "_Finished processing"
+    
+    if processing_time:
+        summary_text += f" • ⏱️ {processing_time:.1f}s"
+    
+    if additional_info:
+        summary_text += f" • Includes {' and '.join(additional_info)}"
+    summary_text += "_"
+    
+    blocks = []
+    
+    # Add question if available
+    if question:
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Your question:* {question}"
+            }
+        })
+        blocks.append(DIVIDER_BLOCK)
+    
+    blocks.append({
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"✅ *Completed!*\n\n{summary_text}"
+        }
+    })
+    blocks.append(DIVIDER_BLOCK)
+    blocks.append({
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": answer_slack or "No answer available"
+        }
+    })
+    return blocks
+
+
 @app.action("show_query_details")
 def handle_show_query_details(ack, body, respond, client):
     """Handle button click to show/hide query details"""
@@ -1206,7 +1431,7 @@ def handle_show_query_details(ack, body, respond, client):
         stored_data = {}
         try:
             if isinstance(action_value, str):
-                stored_data = json.loads(action_value)
+                stored_data = _loads(action_value)
             elif isinstance(action_value, dict):
                 stored_data = action_value
         except (json.JSONDecodeError, TypeError):
@@ -1214,7 +1439,7 @@ def handle_show_query_details(ack, body, respond, client):
             try:
                 raw_value = body["actions"][0].get("value", "")
                 if isinstance(raw_value, str):
-                    stored_data = json.loads(raw_value)
+                    stored_data = _loads(raw_value)
                 elif isinstance(raw_value, dict):
                     stored_data = raw_value
             except (json.JSONDecodeError, KeyError, TypeError) as e:
@@ -1222,9 +1447,11 @@ def handle_show_query_details(ack, body, respond, client):
                 stored_data = {}
         
         # Extract all data from stored_data
-        answer = stored_data.get("answer", "")
+        # Older button payloads carry the raw answer instead of the Slack-formatted one
+        answer_slack = stored_data.get("answer_slack") or (stored_data.get("answer") or "").replace("**", "*")
         sql_query = stored_data.get("sql_query")
-        sql_queries = stored_data.get("sql_queries", [sql_query] if sql_query else [])
+        # Use sql_queries if available, otherwise fall back to sql_query (computed once, reused below)
+        queries = stored_data.get("sql_queries") or ([sql_query] if sql_query else [])
         interpretation = stored_data.get("interpretation")
         verified = stored_data.get("verified", False)
         step_count = stored_data.get("step_count", 0)
@@ -1234,162 +1461,44 @@ def handle_show_query_details(ack, body, respond, client):
         question = stored_data.get("question", "")  # Get question from stored data
         action = stored_data.get("action", "show")
         
+        # Question header, "Completed!" summary and answer are the same in both views
+        blocks = build_header_and_answer_blocks(
+            question, answer_slack, verified, step_count, processing_time, queries
+        )
+        
         if action == "hide":
             # Hide details - restore original message with answer
-            additional_info = []
-            if verified:
-                additional_info.append(f"{VERIFIED_EMOJI} answer accuracy verified by agent owner")
-            # Use sql_queries if available, otherwise fall back to sql_query
-            queries_to_count = sql_queries if sql_queries else ([sql_query] if sql_query else [])
-            if queries_to_count:
-                query_count = len(queries_to_count)
-                additional_info.append(f"{query_count} SQL {'query' if query_count == 1 else 'queries'}")
-            
-            if step_count > 0:
-                summary_text = f"_Finished {step_count} steps"
-            else:
-                summary_text = "_Finished processing"
-            
-            if processing_time:
-                summary_text += f" • ⏱️ {processing_time:.1f}s"
-            
-            if additional_info:
-                summary_text += f" • Includes {' and '.join(additional_info)}"
-            summary_text += "_"
-            
-            # Rebuild the original message structure
-            blocks = []
-            
-            # Add question if available
-            if question:
-                blocks.append({
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Your question:* {question}"
-                    }
-                })
-                blocks.append({"type": "divider"})
-            
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"✅ *Completed!*\n\n{summary_text}"
-                }
-            })
-            blocks.append({"type": "divider"})
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": answer.replace("**", "*") if answer else "No answer available"
-                }
-            })
-            
-            blocks.append({
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "📋 Show Query Details"
-                        },
-                        "action_id": "show_query_details",
-                        "value": truncate_button_value({
-                            "answer": answer,
-                            "sql_query": sql_query,
-                            "sql_queries": sql_queries if sql_queries else ([sql_query] if sql_query else []),
-                            "interpretation": interpretation,
-                            "verified": verified,
-                            "step_count": step_count,
-                            "processing_time": processing_time,
-                            "question": question,  # Store question for details view
-                            "action": "show"
-                        })
-                    }
-                ]
-            })
+            next_action = "show"
+            button_text = "📋 Show Query Details"
         else:
-            # Show details - first show the answer and completion status, then details
-            blocks = []
-            
-            # Add question if available
-            if question:
-                blocks.append({
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Your question:* {question}"
-                    }
-                })
-                blocks.append({"type": "divider"})
-            
-            # First, rebuild the "Completed!" section and answer (same as original message)
-            additional_info = []
-            if verified:
-                additional_info.append(f"{VERIFIED_EMOJI} answer accuracy verified by agent owner")
-            queries_to_count = sql_queries if sql_queries else ([sql_query] if sql_query else [])
-            if queries_to_count:
-                query_count = len(queries_to_count)
-                additional_info.append(f"{query_count} SQL {'query' if query_count == 1 else 'queries'}")
-            
-            if step_count > 0:
-                summary_text = f"_Finished {step_count} steps"
-            else:
-                summary_text = "_Finished processing"
-            
-            if processing_time:
-                summary_text += f" • ⏱️ {processing_time:.1f}s"
-            
-            if additional_info:
-                summary_text += f" • Includes {' and '.join(additional_info)}"
-            summary_text += "_"
-            
-            completed_section_text = f"✅ *Completed!*\n\n{summary_text}"
-            
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": completed_section_text
-                }
-            })
-            
-            blocks.append({"type": "divider"})
-            
-            # Then show the answer
-            answer_formatted = answer.replace("**", "*") if answer else "No answer available"
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": answer_formatted
-                }
-            })
-            
-            blocks.append({"type": "divider"})
+            # Show details - add the SQL queries below the answer
+            next_action = "hide"
+            button_text = "🔽 Hide Query Details"
+            blocks.append(DIVIDER_BLOCK)
             
             # Now add the details (SQL queries only - interpretation not available from API)
             # Add SQL queries (like the example - supports multiple)
-            # Use sql_queries if available, otherwise fall back to sql_query
-            queries_to_show = sql_queries if sql_queries else ([sql_query] if sql_query else [])
-            if queries_to_show:
-                num_queries = len(queries_to_show)
+            if queries:
+                num_queries = len(queries)
                 blocks.append({
                     "type": "section",
                     "text": {
                         "type": "mrkdwn",
-                        "text": f"*💾 SQL Queries:*\nCortex Analyst used {num_queries} SQL {'query' if num_queries == 1 else 'queries'}"
+                        "text": f"*💾 SQL Queries:*\nCortex Analyst used {sql_query_label(num_queries)}"
                     }
                 })
                 
+                # Truncate SQL if too long for Slack (max ~2800 chars), all in one pass
+                displayed_sqls = [
+                    query if len(query) <= 2800 else query[:2800] + "...\n-- (SQL truncated for display)"
+                    for query in queries
+                ]
+                
                 # Add each SQL query with verification badge
-                for i, query in enumerate(queries_to_show, 1):
+                for i, displayed_sql in enumerate(displayed_sqls, 1):
                     query_header = f"*💾 SQL Query {i}:*"
                     if verified and i == 1:  # First query is verified if any are
-                        query_header += f" {VERIFIED_EMOJI} Answer accuracy verified by agent owner"
+                        query_header += VERIFIED_QUERY_SUFFIX
                     
                     blocks.append({
                         "type": "section",
@@ -1399,12 +1508,6 @@ def handle_show_query_details(ack, body, respond, client):
                         }
                     })
                     
-                    # Truncate SQL if too long for Slack (max ~2800 chars)
-                    if len(query) > 2800:
-                        displayed_sql = query[:2800] + "...\n-- (SQL truncated for display)"
-                    else:
-                        displayed_sql = query
-                    
                     blocks.append({
                         "type": "section",
                         "text": {
@@ -1414,54 +1517,37 @@ def handle_show_query_details(ack, body, respond, client):
                     })
                     
                     # Add separator between queries (except for the last one)
-                    if i < len(queries_to_show):
-                        blocks.append({"type": "divider"})
+                    if i < num_queries:
+                        blocks.append(DIVIDER_BLOCK)
                 
                 # Add context message after all queries
-                blocks.append({
-                    "type": "context",
-                    "elements": [
-                        {
-                            "type": "mrkdwn",
-                            "text": "ℹ️ All SQL queries were already executed by Cortex during analysis. Results are included in the response above."
-                        }
-                    ]
-                })
-            
-            if not blocks:
-                blocks.append({
-                    "type": "section",
+                blocks.append(SQL_CONTEXT_BLOCK)
+        
+        # Add the show/hide toggle button
+        blocks.append({
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
                     "text": {
-                        "type": "mrkdwn",
-                        "text": "No additional details available."
-                    }
-                })
-            
-            # Add hide button
-            blocks.append({
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🔽 Hide Query Details"
-                        },
-                        "action_id": "show_query_details",
-                        "value": truncate_button_value({
-                            "answer": answer,
-                            "sql_query": sql_query,
-                            "sql_queries": sql_queries if sql_queries else ([sql_query] if sql_query else []),
-                            "interpretation": interpretation,
-                            "verified": verified,
-                            "step_count": step_count,
-                            "processing_time": processing_time,
-                            "question": question,  # Store question for details view
-                            "action": "hide"
-                        })
-                    }
-                ]
-            })
+                        "type": "plain_text",
+                        "text": button_text
+                    },
+                    "action_id": "show_query_details",
+                    "value": truncate_button_value({
+                        "answer_slack": answer_slack,
+                        "sql_query": sql_query,
+                        "sql_queries": queries,
+                        "interpretation": interpretation,
+                        "verified": verified,
+                        "step_count": step_count,
+                        "processing_time": processing_time,
+                        "question": question,  # Store question for details view
+                        "action": next_action
+                    })
+                }
+            ]
+        })
         
         # Update the message
         try:
@@ -1487,8 +1573,42 @@ def handle_show_query_details(ack, body, respond, client):
         )
 
 
-def get_welcome_message():
-    """Generate welcome message with instructions and example questions"""
+# Quick-start buttons on the welcome message as (button label, question), three per row;
+# action_ids are quick_question_1..N in this order
+_QUICK_QUESTIONS = (
+    ("📈 Customers signed this year", "How many contracts were signed this year?"),
+    ("📉 Churn last month", "How many customers churned last month?"),
+    ("🇸🇪 Top performing Swedish Channels ", "Which channels brought in the most number of customers in Sweden last quarter ? "),
+    (":electric_plug: EV & Charging Station Customers", "How many users that signed in 2025 have both an EV and Charging Station connected?"),
+    (":bulb: Rörligt customers", "Which channels drove the most variable-price contracts in January 2026?"),
+    (":credit_card: Autogiro customers", ":What share of Swedish customers use autogiro today?"),
+)
+
+
+def _build_welcome_message():
+    """
+    Generate welcome message with instructions and example questions.
+    Called once at import time; handlers use WELCOME_BLOCKS.
+    """
+    quick_question_rows = [
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": label
+                    },
+                    "action_id": f"quick_question_{number}",
+                    "value": question
+                }
+                for number, (label, question) in enumerate(_QUICK_QUESTIONS[row:row + 3], start=row + 1)
+            ]
+        }
+        for row in range(0, len(_QUICK_QUESTIONS), 3)
+    ]
+    
     return {
         "blocks": [
             {
@@ -1515,70 +1635,7 @@ def get_welcome_message():
                     "text": "*:1234: Quick Start Questions:*\nClick a button below to ask a common question:"
                 }
             },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "📈 Customers signed this year"
-                        },
-                        "action_id": "quick_question_1",
-                        "value": "How many contracts were signed this year?"
-                    },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "📉 Churn last month"
-                        },
-                        "action_id": "quick_question_2",
-                        "value": "How many customers churned last month?"
-                    },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🇸🇪 Top performing Swedish Channels "
-                        },
-                        "action_id": "quick_question_3",
-                        "value": "Which channels brought in the most number of customers in Sweden last quarter ? "
-                    }
-                ]
-            },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": ":electric_plug: EV & Charging Station Customers"
-                        },
-                        "action_id": "quick_question_4",
-                        "value": "How many users that signed in 2025 have both an EV and Charging Station connected?"
-                    },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": ":bulb: Rörligt customers"
-                        },
-                        "action_id": "quick_question_5",
-                        "value": "Which channels drove the most variable-price contracts in January 2026?"
-                    },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": ":credit_card: Autogiro customers"
-                        },
-                        "action_id": "quick_question_6",
-                        "value": ":What share of Swedish customers use autogiro today?"
-                    }
-                ]
-            },
+            *quick_question_rows,
             {
                 "type": "divider"
             },
@@ -1619,26 +1676,52 @@ def get_welcome_message():
     }
 
 
+# The welcome payload is static, so build it once; Slack only serializes it, callers must not mutate it
+WELCOME_BLOCKS = _build_welcome_message()["blocks"]
+WELCOME_TEXT = "👋 Welcome to Dex - Your Contract Analytics Assistant"
+HELP_TEXT = "Dex Help - Contract Analytics Assistant"
+
+
+# The bot's user ID per workspace (team ID -> user ID); it never changes for an installation
+_bot_user_ids = {}
+
+
+def get_bot_user_id(client, team_id=None):
+    """
+    Return the bot's Slack user ID for a workspace, calling auth.test only once per team.
+    client must be the handler's own workspace client, not the app-wide app.client, which
+    carries no workspace's bot token.
+    """
+    bot_user_id = _bot_user_ids.get(team_id)
+    if bot_user_id is None:
+        bot_user_id = client.auth_test()["user_id"]
+        # Without a team ID we can't tell workspaces apart, so don't cache
+        if team_id:
+            _bot_user_ids[team_id] = bot_user_id
+    return bot_user_id
+
+
 @app.event("member_joined_channel")
-def handle_member_joined_channel(event, client):
+def handle_member_joined_channel(event, client, context):
     """
     Handle when a member (including the bot) joins a channel.
     Post welcome message if it's the bot that joined.
     """
     try:
-        # Get bot's user ID
-        bot_user_id = app.client.auth_test()["user_id"]
+        # Get bot's user ID: the installation's (set by set_bot_token), else auth.test on this workspace's client
+        bot_user_id = context.get("bot_user_id") or get_bot_user_id(
+            client, event.get("team") or context.get("team_id")
+        )
         user_id = event.get("user")
         
         # Only post welcome message if the bot itself joined
         if user_id == bot_user_id:
             channel_id = event.get("channel")
             if channel_id:
-                welcome_msg = get_welcome_message()
                 client.chat_postMessage(
                     channel=channel_id,
-                    blocks=welcome_msg["blocks"],
-                    text="👋 Welcome to Dex - Your Contract Analytics Assistant"
+                    blocks=WELCOME_BLOCKS,
+                    text=WELCOME_TEXT
                 )
     except Exception as e:
         logger.warning(f"Could not post welcome message: {e}")
@@ -1656,22 +1739,15 @@ def handle_mention(event, say):
     thread_ts = event.get("thread_ts") or event.get("ts")  # Use thread_ts if in thread, otherwise reply to the mention itself
     
     # Remove the mention from the text
-    try:
-        bot_user_id = app.client.auth_test()['user_id']
-        text = text.replace(f"<@{bot_user_id}>", "").strip()
-    except:
-        # Fallback: remove any mention pattern
-        import re
-        text = re.sub(r'<@[A-Z0-9]+>', '', text).strip()
+    text = _MENTION_RE.sub('', text).strip()
     
     if not text:
         # If just mentioned without a question, show welcome message
-        welcome_msg = get_welcome_message()
-        say(blocks=welcome_msg["blocks"], text="Dex Help - Contract Analytics Assistant", thread_ts=thread_ts)
+        say(blocks=WELCOME_BLOCKS, text=HELP_TEXT, thread_ts=thread_ts)
         return
     
     # Call Cortex Agent
-    response_data = call_cortex_agent(text)
+    response_data = ask_cortex_agent(text)
     
     # Format response with optional "Show Query Details" button (include question for display)
     blocks, text_fallback = format_slack_response(
@@ -1686,6 +1762,105 @@ def handle_mention(event, say):
         say(text_fallback, thread_ts=thread_ts)
 
 
+def post_to_response_url(response_url, payload):
+    """
+    POST a message payload to a Slack response_url and return the HTTP response.
+    Serialized with _dumps (orjson when installed, raw UTF-8 instead of \\u escapes); None values are dropped.
+    Bounded by RESPONSE_URL_TIMEOUT; a timeout raises like any other request error.
+    """
+    payload = {k: v for k, v in payload.items() if v is not None}
+    return requests.post(
+        response_url,
+        data=_dumps(payload).encode(),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+        timeout=RESPONSE_URL_TIMEOUT
+    )
+
+
+def answer_command_in_background(client, question, channel_id, initial_response, start_time, response_url, respond, agent_future=None):
+    """
+    Deliver the answer to a /dex question, taking it from agent_future if the Cortex call was already started.
+    When response_url is set the processing message posted there is replaced (replace_original),
+    with initial_response it is updated with chat_update, otherwise the answer is sent as a new
+    message; errors are reported the same way, in_channel on every path.
+    """
+    try:
+        # Call Cortex Agent
+        response_data = agent_future.result() if agent_future else ask_cortex_agent(question)
+        
+        # Calculate total processing time BEFORE formatting (so it can be displayed)
+        elapsed_time = time.time() - start_time
+        if isinstance(response_data, AgentResponse):
+            response_data.processing_time = elapsed_time
+        
+        # Format response (this should be fast - just building Slack blocks)
+        blocks, text_fallback = format_slack_response(
+            response_data, 
+            question=question
+        )
+    except Exception as e:
+        # Log the error for debugging
+        logger.error(f"Error calling Cortex Agent: {str(e)}", exc_info=True)
+        error_response = (
+            f"❌ Sorry, I encountered an error while processing your question.\n\n"
+            f"Error: {str(e)}\n\n"
+            f"Please try again or contact support if the issue persists."
+        )
+        try:
+            if response_url:
+                post_to_response_url(
+                    response_url,
+                    {"text": error_response, "response_type": "in_channel", "replace_original": True}
+                ).raise_for_status()
+            else:
+                # Same visibility as the response_url path (respond() defaults to ephemeral)
+                respond(text=error_response, response_type="in_channel")
+        except Exception as respond_error:
+            logger.error(f"Could not report Cortex Agent error: {respond_error}", exc_info=True)
+        return
+    
+    response_payload = {
+        "blocks": blocks if blocks else None,
+        "text": text_fallback,
+        "response_type": "in_channel",
+        "replace_original": True
+    }
+    
+    # Update the initial processing message with the final response
+    try:
+        if response_url:
+            # Replace the processing message through the same response_url (no Web API call)
+            post_to_response_url(response_url, response_payload).raise_for_status()
+        elif initial_response and initial_response.get('ts'):
+            # Update the processing message with the final response (non-thread case)
+            client.chat_update(
+                channel=initial_response.get('channel') or channel_id,
+                ts=initial_response['ts'],
+                text=text_fallback,
+                blocks=blocks if blocks else None
+            )
+        else:
+            # No processing message to replace (fast answer, or its ts is unknown): send a new message
+            if blocks:
+                respond(blocks=blocks, text=text_fallback, response_type="in_channel")
+            else:
+                respond(text=text_fallback, response_type="in_channel")
+    except Exception as update_error:
+        # If update fails, send as new message
+        logger.error(f"Could not update message: {update_error}", exc_info=True)
+        try:
+            if response_url:
+                # Couldn't replace the processing message, post the answer as a new one
+                del response_payload["replace_original"]
+                post_to_response_url(response_url, response_payload).raise_for_status()
+            elif blocks:
+                respond(blocks=blocks, text=text_fallback, response_type="in_channel")
+            else:
+                respond(text=text_fallback, response_type="in_channel")
+        except Exception as e:
+            logger.error(f"Error posting response: {str(e)}")
+
+
 @app.command("/dex")
 def handle_dex_command(ack, respond, command):
     """
@@ -1702,16 +1877,10 @@ def handle_dex_command(ack, respond, command):
         ack()
         logger.info("✅ Successfully acknowledged /dex command")
     except Exception as ack_error:
-        # If ack fails, this is critical - log it and try again
+        # If ack fails, this is critical - log it; retrying doesn't help (a second ack raises in Bolt)
         logger.error(f"❌ CRITICAL: Failed to acknowledge /dex command: {ack_error}", exc_info=True)
-        # Try once more as a fallback
-        try:
-            ack()
-            logger.info("✅ Successfully acknowledged /dex command on retry")
-        except Exception as retry_error:
-            logger.error(f"❌ CRITICAL: Failed to acknowledge /dex command on retry: {retry_error}", exc_info=True)
-            # If ack fails completely, we can't do anything - Slack will show "dispatch_failed"
-            return  # Exit early - can't proceed without ack()
+        # We can't do anything - Slack will show "dispatch_failed"
+        return  # Exit early - can't proceed without ack()
     
     # Now process the command (after ack is done)
     # IMPORTANT: ack() has been called, so Slack won't show "dispatch_failed" anymore
@@ -1720,14 +1889,15 @@ def handle_dex_command(ack, respond, command):
     try:
         # For slash commands, we need the bot token for respond() and chat_postMessage
         # Do the installation lookup now (after ack() is called) so it doesn't delay ack()
+        # The workspace client stays local to this command: app.client is shared by every workspace
+        client = app.client
         team_id = command.get("team_id") or command.get("enterprise_id")
         if team_id:
             try:
                 installation = installation_store.find_installation(team_id=team_id)
                 if installation and installation.bot_token:
-                    # Set client now (after ack() is called)
-                    from slack_sdk import WebClient
-                    app.client = WebClient(token=installation.bot_token)
+                    # Build this workspace's client now (after ack() is called)
+                    client = WebClient(token=installation.bot_token)
                 else:
                     logger.warning(f"No installation found for workspace: {team_id}")
                     # Still try to respond with helpful error
@@ -1742,9 +1912,9 @@ def handle_dex_command(ack, respond, command):
                     )
                     response_url = command.get("response_url")
                     if response_url:
-                        requests.post(
+                        post_to_response_url(
                             response_url,
-                            json={
+                            {
                                 "text": error_msg,
                                 "response_type": "ephemeral"
                             }
@@ -1759,20 +1929,21 @@ def handle_dex_command(ack, respond, command):
                     error_msg = f"❌ Error: Could not find installation. Please reinstall the app from {SLACK_BOT_URL}"
                     response_url = command.get("response_url")
                     if response_url:
-                        requests.post(
+                        post_to_response_url(
                             response_url,
-                            json={
+                            {
                                 "text": error_msg,
                                 "response_type": "ephemeral"
                             }
                         )
                     else:
                         respond(error_msg)
-                except:
-                    pass
+                except Exception as respond_error:
+                    logger.error(f"Could not send installation error response: {respond_error}")
                 return
         
-        question = command.get("text", "").strip()
+        # Read and strip the text once; interned since quick-start questions repeat across users
+        question = sys.intern(command.get("text", "").strip())
         
         # Get response_url for thread support (Slack provides this when command is in a thread)
         response_url = command.get("response_url")
@@ -1782,52 +1953,38 @@ def handle_dex_command(ack, respond, command):
         is_in_thread = response_url is not None
         
         # Deduplication: Check if this exact command was processed recently
-        # Use command_id if available, otherwise use user_id + question + timestamp
-        command_id = command.get("command_id") or command.get("trigger_id")
-        user_id = command.get("user_id", "unknown")
-        current_time = time.time()
-        
-        # Create a unique key for this command
-        if command_id:
-            command_key = f"{command_id}"
-        else:
+        # trigger_id is unique per invocation and present on every real slash command
+        command_key = command.get("trigger_id") or command.get("command_id")
+        if not command_key:
             # Fallback: use user + question + rounded timestamp (within 5 seconds)
-            rounded_time = int(current_time / 5) * 5
-            command_key = f"{user_id}:{question}:{rounded_time}"
-        
-        # Check if we're already processing this command
-        if command_key in _command_lock:
-            logger.info(f"Ignoring duplicate command: {command_key}")
-            return
+            rounded_time = int(time.time() / 5) * 5
+            command_key = f"{command.get('user_id', 'unknown')}:{question}:{rounded_time}"
         
-        # Check if this command was processed very recently (within last 2 seconds)
-        if command_key in _recent_commands:
-            logger.info(f"Ignoring recently processed command: {command_key}")
+        # Ignore commands that are in flight or were handled recently
+        state = claim_command(command_key)
+        if state:
+            logger.info(f"Ignoring duplicate command ({state}): {command_key}")
             return
         
-        # Mark as being processed
-        _command_lock[command_key] = current_time
-        _recent_commands.append(command_key)
         if not question:
             # Show welcome message when /dex is used without a question
             try:
-                welcome_msg = get_welcome_message()
                 # Send full welcome message directly (replaces simple text message)
                 # If in thread, use response_url; otherwise use respond()
                 if is_in_thread and response_url:
                     # Use response_url to post in thread
-                    requests.post(
+                    post_to_response_url(
                         response_url,
-                        json={
-                            "blocks": welcome_msg["blocks"],
-                            "text": "👋 Welcome to Dex - Your Contract Analytics Assistant",
+                        {
+                            "blocks": WELCOME_BLOCKS,
+                            "text": WELCOME_TEXT,
                             "response_type": "in_channel"
                         }
                     )
                 else:
                     respond(
-                        blocks=welcome_msg["blocks"],
-                        text="👋 Welcome to Dex - Your Contract Analytics Assistant",
+                        blocks=WELCOME_BLOCKS,
+                        text=WELCOME_TEXT,
                         response_type="in_channel"
                     )
             except Exception as welcome_error:
@@ -1839,9 +1996,9 @@ def handle_dex_command(ack, respond, command):
                     "Example: `/dex how many contracts were signed last month?`"
                 )
                 if is_in_thread and response_url:
-                    requests.post(
+                    post_to_response_url(
                         response_url,
-                        json={
+                        {
                             "text": fallback_msg,
                             "response_type": "in_channel"
                         }
@@ -1864,9 +2021,9 @@ def handle_dex_command(ack, respond, command):
                 "• What's the churn rate by country?"
             )
             if is_in_thread and response_url:
-                requests.post(
+                post_to_response_url(
                     response_url,
-                    json={
+                    {
                         "text": error_msg,
                         "response_type": "in_channel"
                     }
@@ -1875,140 +2032,79 @@ def handle_dex_command(ack, respond, command):
                 respond(error_msg)
         else:
             try:
-                # Send initial message with question and processing status
-                # Use app.client.chat_postMessage instead of respond() to avoid dispatch issues
                 start_time = time.time()
+                channel_id = command.get("channel_id")
                 
-                # Combine question and processing message in one post
-                # If in thread, use response_url; otherwise use chat_postMessage
-                initial_blocks = [
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Your question:* {question}"
-                        }
-                    },
-                    {
-                        "type": "divider"
-                    },
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": ":snowflake: *Snowflake Cortex Agent* is processing your request...",
-                        }
-                    },
-                    {
-                        "type": "divider"
-                    },
-                ]
-                
-                if is_in_thread and response_url:
-                    # Use response_url to post in thread (this will automatically post in thread context)
-                    initial_response = requests.post(
-                        response_url,
-                        json={
-                            "blocks": initial_blocks,
-                            "text": f"Your question: {question}\n\nProcessing...",
-                            "response_type": "in_channel"
-                        }
-                    )
-                    # Extract message info from response if available
-                    initial_response_data = {"ts": None, "channel": command.get("channel_id")}
-                    if initial_response.status_code == 200:
-                        try:
-                            response_json = initial_response.json()
-                            initial_response_data["ts"] = response_json.get("ts")
-                        except:
-                            pass
-                    initial_message = initial_response_data
-                else:
-                    # Post normally using chat_postMessage
-                    initial_message = app.client.chat_postMessage(
-                        channel=command.get("channel_id"),
-                        text=f"Your question: {question}\n\nProcessing...",
-                        blocks=initial_blocks
+                # Start the Cortex call right away and give it a moment: an answer already in the
+                # cache is posted directly, without a processing message to post and then replace
+                agent_future = _agent_executor.submit(ask_cortex_agent, question)
+                wait([agent_future], timeout=FAST_ANSWER_TIMEOUT)
+                if agent_future.done():
+                    answer_command_in_background(
+                        client, question, channel_id, None, start_time, None, respond, agent_future
                     )
-                # Extract message info for updates
-                if isinstance(initial_message, dict):
-                    initial_response = {"ts": initial_message.get("ts"), "channel": initial_message.get("channel")}
                 else:
-                    initial_response = {"ts": initial_message.get("ts"), "channel": initial_message.get("channel")} if initial_message else None
-                channel_id = command.get("channel_id")  # Store for later use
-                
-                # Call Cortex Agent
-                response_data = call_cortex_agent(question)
-                
-                # Calculate total processing time BEFORE formatting (so it can be displayed)
-                elapsed_time = time.time() - start_time
-                if isinstance(response_data, dict):
-                    response_data['processing_time'] = elapsed_time
-                
-                # Format response (this should be fast - just building Slack blocks)
-                blocks, text_fallback = format_slack_response(
-                    response_data, 
-                    question=question
-                )
-                
-                # Update the initial processing message with the final response
-                try:
+                    # Send initial message with question and processing status
+                    # If in thread, use response_url; otherwise use chat_postMessage
+                    initial_blocks = processing_blocks(question)
+                    
                     if is_in_thread and response_url:
-                        # When in thread, we can't update the message, so post a new one in the thread
-                        # Use response_url again to post in the same thread
-                        response_payload = {
-                            "blocks": blocks if blocks else None,
-                            "text": text_fallback,
-                            "response_type": "in_channel"
-                        }
-                        # Remove None values
-                        response_payload = {k: v for k, v in response_payload.items() if v is not None}
-                        requests.post(response_url, json=response_payload)
-                    elif initial_response and 'ts' in initial_response and initial_response['ts']:
-                        # Update the processing message with the final response (non-thread case)
-                        app.client.chat_update(
-                            channel=initial_response.get('channel', channel_id),
-                            ts=initial_response['ts'],
-                            text=text_fallback,
-                            blocks=blocks if blocks else None
+                        # Use response_url to post in thread (this will automatically post in thread context)
+                        initial_response = post_to_response_url(
+                            response_url,
+                            {
+                                "blocks": initial_blocks,
+                                "text": f"Your question: {question}\n\nProcessing...",
+                                "response_type": "in_channel"
+                            }
                         )
+                        # Extract message info from response if available
+                        initial_response_data = {"ts": None, "channel": command.get("channel_id")}
+                        if initial_response.status_code == 200:
+                            try:
+                                response_json = initial_response.json()
+                                initial_response_data["ts"] = response_json.get("ts")
+                            except ValueError:
+                                pass  # response_url replies with plain "ok", not JSON
+                        initial_message = initial_response_data
                     else:
-                        # Fallback: send new message if update not possible
-                        logger.warning("initial_response missing 'ts', sending new message")
-                        if blocks:
-                            respond(blocks=blocks, text=text_fallback, response_type="in_channel")
-                        else:
-                            respond(text=text_fallback, response_type="in_channel")
-                except Exception as update_error:
-                    # If update fails, send as new message
-                    logger.error(f"Could not update message: {update_error}", exc_info=True)
-                    if is_in_thread and response_url:
-                        # Post in thread using response_url
-                        response_payload = {
-                            "blocks": blocks if blocks else None,
-                            "text": text_fallback,
-                            "response_type": "in_channel"
-                        }
-                        response_payload = {k: v for k, v in response_payload.items() if v is not None}
-                        requests.post(response_url, json=response_payload)
+                        # Post normally using chat_postMessage
+                        initial_message = client.chat_postMessage(
+                            channel=command.get("channel_id"),
+                            text=f"Your question: {question}\n\nProcessing...",
+                            blocks=initial_blocks
+                        )
+                    # Extract message info for updates
+                    if isinstance(initial_message, dict):
+                        initial_response = {"ts": initial_message.get("ts"), "channel": initial_message.get("channel")}
                     else:
-                        # Post normally
-                        if blocks:
-                            respond(blocks=blocks, text=text_fallback, response_type="in_channel")
-                        else:
-                            respond(text=text_fallback, response_type="in_channel")
+                        initial_response = {"ts": initial_message.get("ts"), "channel": initial_message.get("channel")} if initial_message else None
+                    
+                    # Deliver the answer from the pool thread that finishes the Cortex call
+                    agent_future.add_done_callback(
+                        lambda done: answer_command_in_background(
+                            client,
+                            question,
+                            channel_id,
+                            initial_response,
+                            start_time,
+                            response_url if is_in_thread else None,
+                            respond,
+                            done,
+                        )
+                    )
             except Exception as e:
                 # Log the error for debugging
-                logger.error(f"Error calling Cortex Agent: {str(e)}", exc_info=True)
+                logger.error(f"Error starting Cortex Agent request: {str(e)}", exc_info=True)
                 error_response = (
                     f"❌ Sorry, I encountered an error while processing your question.\n\n"
                     f"Error: {str(e)}\n\n"
                     f"Please try again or contact support if the issue persists."
                 )
                 if is_in_thread and response_url:
-                    requests.post(
+                    post_to_response_url(
                         response_url,
-                        json={
+                        {
                             "text": error_response,
                             "response_type": "in_channel"
                         }
@@ -2016,15 +2112,7 @@ def handle_dex_command(ack, respond, command):
                 else:
                     respond(error_response)
             finally:
-                # Clean up: remove from processing lock after a delay
-                # This allows the same command to be processed again after 10 seconds if needed
-                if 'command_key' in locals():
-                    def cleanup_lock():
-                        time.sleep(10)
-                        if command_key in _command_lock:
-                            del _command_lock[command_key]
-                    import threading
-                    threading.Thread(target=cleanup_lock, daemon=True).start()
+                mark_command_done(command_key)
     except Exception as e:
         # Log any errors in the handler itself
         logger.error(f"Error in /dex command handler: {str(e)}", exc_info=True)
@@ -2034,22 +2122,22 @@ def handle_dex_command(ack, respond, command):
             response_url = command.get("response_url")
             if response_url:
                 # Post in thread if command was in thread
-                requests.post(
+                post_to_response_url(
                     response_url,
-                    json={
+                    {
                         "text": error_msg,
                         "response_type": "in_channel"
                     }
                 )
             else:
                 respond(error_msg)
-        except:
+        except Exception as respond_error:
             # If we can't respond, at least log it
-            pass
+            logger.error(f"Could not send error response: {respond_error}")
         finally:
-            # Clean up lock on error too
-            if 'command_key' in locals() and command_key in _command_lock:
-                del _command_lock[command_key]
+            # Mark done on error too
+            if 'command_key' in locals():
+                mark_command_done(command_key)
 
 
 # Flask routes for OAuth and Slack events
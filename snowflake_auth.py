@@ -0,0 +1,12 @@
+"""
+Snowflake key-pair authentication helpers shared by the data scripts.
+"""
+import functools
+from cryptography.hazmat.primitives import serialization
+
+
+@functools.lru_cache(maxsize=1)
+def load_private_key(path):
+    """Load private key for Snowflake authentication (parsed once per process)"""
+    with open(path, "rb") as key_file:
+        return serialization.load_pem_private_key(key_file.read(), password=None)